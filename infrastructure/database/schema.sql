@@ -12,8 +12,7 @@ CREATE TABLE IF NOT EXISTS users (
     is_active BOOLEAN DEFAULT TRUE
 );
 
--- Create index on email for faster lookups
-CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+-- email lookups use the UNIQUE constraint's index
 
 -- Forms table
 CREATE TABLE IF NOT EXISTS forms (
@@ -27,31 +26,71 @@ CREATE TABLE IF NOT EXISTS forms (
     is_active BOOLEAN DEFAULT TRUE
 );
 
--- Submissions table
+-- Submissions table, range partitioned by month of submitted_at
+-- (partitions are created and expired by scripts/partitions.py)
 CREATE TABLE IF NOT EXISTS submissions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     form_id INTEGER REFERENCES forms(id) ON DELETE CASCADE,
     submitter_name VARCHAR(255),
     submitter_email VARCHAR(255),
-    submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    submitted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     plagiarism_score INTEGER DEFAULT 0,
     ai_score INTEGER DEFAULT 0,
     quality_score INTEGER DEFAULT 0,
     status VARCHAR(50) DEFAULT 'pending', -- 'pending', 'clean', 'warning', 'flagged'
     rank INTEGER,
-    data JSONB -- Store the actual form responses
-);
+    data JSONB, -- Store the actual form responses
+    PRIMARY KEY (id, submitted_at) -- the partition key must be part of it
+) PARTITION BY RANGE (submitted_at);
 
 -- Analysis results table
 CREATE TABLE IF NOT EXISTS analysis_results (
     id SERIAL PRIMARY KEY,
-    submission_id INTEGER REFERENCES submissions(id) ON DELETE CASCADE,
+    submission_id INTEGER NOT NULL, -- no FK to partitioned submissions; deleted by trigger
     analysis_type VARCHAR(50) NOT NULL, -- 'plagiarism', 'ai_detection', 'quality'
     score INTEGER,
     details JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Analysis jobs table (queued analyze requests and their outcome)
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id UUID PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    submission_id INTEGER NOT NULL, -- no FK to partitioned submissions; deleted by trigger
+    analysis_type VARCHAR(50) NOT NULL, -- 'plagiarism', 'ai'
+    status VARCHAR(20) NOT NULL DEFAULT 'queued', -- 'queued', 'running', 'completed', 'failed'
+    score INTEGER,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Bulk analysis runs (form-wide analyze requests, their progress and checkpoint)
+CREATE TABLE IF NOT EXISTS bulk_analysis_runs (
+    id UUID PRIMARY KEY,
+    form_id INTEGER REFERENCES forms(id) ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    analyses TEXT[] NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    concurrency INTEGER NOT NULL,
+    only_missing BOOLEAN NOT NULL,
+    start_after_id INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(30) NOT NULL DEFAULT 'pending', -- 'pending', 'running', 'completed', 'completed_with_errors', 'failed'
+    total_submissions INTEGER NOT NULL DEFAULT 0,
+    processed_submissions INTEGER NOT NULL DEFAULT 0,
+    analyses_run INTEGER NOT NULL DEFAULT 0,
+    analyses_skipped INTEGER NOT NULL DEFAULT 0,
+    analyses_failed INTEGER NOT NULL DEFAULT 0,
+    failed_submission_ids INTEGER[] NOT NULL DEFAULT '{}',
+    checkpoint_submission_id INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+
 -- Credits transactions table
 CREATE TABLE IF NOT EXISTS credit_transactions (
     id SERIAL PRIMARY KEY,
@@ -62,20 +101,114 @@ CREATE TABLE IF NOT EXISTS credit_transactions (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Activity log table
+-- Activity log table, range partitioned by month of created_at
 CREATE TABLE IF NOT EXISTS activity_log (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     activity_type VARCHAR(50) NOT NULL,
     description TEXT,
     metadata JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Default partitions catch rows outside the monthly ranges; keep them empty
+CREATE TABLE IF NOT EXISTS submissions_default PARTITION OF submissions DEFAULT;
+CREATE TABLE IF NOT EXISTS activity_log_default PARTITION OF activity_log DEFAULT;
+
+-- This month and the next three; scripts/partitions.py maintain keeps them coming
+DO $$
+DECLARE
+    month_start DATE;
+    parent TEXT;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['submissions', 'activity_log'] LOOP
+        FOR i IN 0..3 LOOP
+            month_start := date_trunc('month', CURRENT_DATE)::date + make_interval(months => i);
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                parent || '_p' || to_char(month_start, 'YYYYMM'), parent,
+                month_start, (month_start + interval '1 month')::date
+            );
+        END LOOP;
+    END LOOP;
+END;
+$$;
 
 -- Create indexes for better performance
+-- (revised from scripts/index_audit.py; existing databases get these via migrations 0002 and 0006)
+-- A user's forms (and the cascade when a user is deleted)
 CREATE INDEX IF NOT EXISTS idx_forms_user_id ON forms(user_id);
-CREATE INDEX IF NOT EXISTS idx_submissions_form_id ON submissions(form_id);
-CREATE INDEX IF NOT EXISTS idx_submissions_status ON submissions(status);
-CREATE INDEX IF NOT EXISTS idx_analysis_submission_id ON analysis_results(submission_id);
+-- Bulk analysis walks a form's submissions by id (and counts them index-only)
+CREATE INDEX IF NOT EXISTS idx_submissions_form_id_id ON submissions(form_id, id);
+-- Keyset pagination of a form's submissions by (submitted_at, id)
+CREATE INDEX IF NOT EXISTS idx_submissions_form_submitted_id ON submissions(form_id, submitted_at, id);
+-- Latest result per type, and index-only "which types are done" lookups
+CREATE INDEX IF NOT EXISTS idx_analysis_results_submission_type ON analysis_results(submission_id, analysis_type, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_user_id ON analysis_jobs(user_id);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_submission_id ON analysis_jobs(submission_id);
+CREATE INDEX IF NOT EXISTS idx_bulk_analysis_runs_form_id ON bulk_analysis_runs(form_id);
+CREATE INDEX IF NOT EXISTS idx_bulk_analysis_runs_user_id ON bulk_analysis_runs(user_id);
 CREATE INDEX IF NOT EXISTS idx_credit_transactions_user_id ON credit_transactions(user_id);
 CREATE INDEX IF NOT EXISTS idx_activity_log_user_id ON activity_log(user_id);
+
+-- Notify gateways to drop cached rankings when results or ranks change
+CREATE OR REPLACE FUNCTION notify_rankings_invalidate() RETURNS trigger AS $$
+BEGIN
+    -- On submissions this fires on a partition, so TG_TABLE_NAME is the partition's name
+    IF TG_TABLE_NAME = 'analysis_results' THEN
+        PERFORM pg_notify('rankings_invalidate',
+            COALESCE((SELECT form_id::text FROM submissions WHERE id = NEW.submission_id), ''));
+    ELSE
+        PERFORM pg_notify('rankings_invalidate', NEW.form_id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_analysis_results_rankings ON analysis_results;
+CREATE TRIGGER trg_analysis_results_rankings
+    AFTER INSERT OR UPDATE ON analysis_results
+    FOR EACH ROW EXECUTE FUNCTION notify_rankings_invalidate();
+
+DROP TRIGGER IF EXISTS trg_submissions_rank_rankings ON submissions;
+CREATE TRIGGER trg_submissions_rank_rankings
+    AFTER UPDATE OF rank ON submissions
+    FOR EACH ROW WHEN (OLD.rank IS DISTINCT FROM NEW.rank)
+    EXECUTE FUNCTION notify_rankings_invalidate();
+
+-- Notify gateways to drop a cached principal when tier or is_active change
+CREATE OR REPLACE FUNCTION notify_user_principal_invalidate() RETURNS trigger AS $$
+BEGIN
+    -- Payload is the JWT subject (email); an email change must drop the old one
+    PERFORM pg_notify('user_principal_invalidate', OLD.email);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_principal_invalidate ON users;
+CREATE TRIGGER trg_users_principal_invalidate
+    AFTER UPDATE OF email, tier, is_active ON users
+    FOR EACH ROW WHEN (OLD.email IS DISTINCT FROM NEW.email
+                       OR OLD.tier IS DISTINCT FROM NEW.tier
+                       OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+    EXECUTE FUNCTION notify_user_principal_invalidate();
+
+DROP TRIGGER IF EXISTS trg_users_principal_delete ON users;
+CREATE TRIGGER trg_users_principal_delete
+    AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_user_principal_invalidate();
+
+-- Delete a submission's analysis rows with it (foreign keys can't reference a partitioned id)
+CREATE OR REPLACE FUNCTION delete_submission_dependents() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM analysis_results WHERE submission_id = OLD.id;
+    DELETE FROM analysis_jobs WHERE submission_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_submissions_delete_dependents ON submissions;
+CREATE TRIGGER trg_submissions_delete_dependents
+    AFTER DELETE ON submissions
+    FOR EACH ROW EXECUTE FUNCTION delete_submission_dependents();
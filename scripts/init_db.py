@@ -2,6 +2,9 @@
 Database Schema Initialization Script for SmartScreen AI
 Run this script to create all necessary tables in your Neon PostgreSQL database
 
+Creates the base tables, then applies any pending versioned migrations
+(scripts/migrate.py), so a fresh database ends up at the latest revision
+
 Usage:
     python scripts/init_db.py
     
@@ -11,8 +14,12 @@ Environment Variables Required:
 import os
 import sys
 import psycopg2
+from datetime import date
 from psycopg2 import sql
 
+from migrate import apply_pending
+from partitions import PARTITIONED_TABLES, add_months, create_partitions, is_partitioned, month_start
+
 def get_database_url():
     """Get database URL from environment variable"""
     db_url = os.getenv("DATABASE_URL")
@@ -38,7 +45,6 @@ def create_users_table(cursor):
             is_active BOOLEAN DEFAULT TRUE
         )
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
     print("  ✅ Users table created")
 
 def create_forms_table(cursor):
@@ -56,29 +62,34 @@ def create_forms_table(cursor):
             is_active BOOLEAN DEFAULT TRUE
         )
     """)
+    # A user's forms (and the cascade when a user is deleted)
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_forms_user_id ON forms(user_id)")
     print("  ✅ Forms table created")
 
 def create_submissions_table(cursor):
-    """Create submissions table with indexes"""
+    """Create submissions table (range partitioned by month of submitted_at) with indexes"""
     print("📋 Creating submissions table...")
+    # The partition key must be part of the primary key; ids still come from one sequence
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS submissions (
-            id SERIAL PRIMARY KEY,
+            id SERIAL,
             form_id INTEGER REFERENCES forms(id) ON DELETE CASCADE,
             submitter_name VARCHAR(255),
             submitter_email VARCHAR(255),
-            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            submitted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
             plagiarism_score INTEGER DEFAULT 0,
             ai_score INTEGER DEFAULT 0,
             quality_score INTEGER DEFAULT 0,
             status VARCHAR(50) DEFAULT 'pending',
             rank INTEGER,
-            data JSONB
-        )
+            data JSONB,
+            PRIMARY KEY (id, submitted_at)
+        ) PARTITION BY RANGE (submitted_at)
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_form_id ON submissions(form_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_status ON submissions(status)")
+    # Bulk analysis walks a form's submissions by id (and counts them index-only)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_form_id_id ON submissions(form_id, id)")
+    # Keyset pagination of a form's submissions by (submitted_at, id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_submissions_form_submitted_id ON submissions(form_id, submitted_at, id)")
     print("  ✅ Submissions table created")
 
 def create_analysis_results_table(cursor):
@@ -87,16 +98,72 @@ def create_analysis_results_table(cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS analysis_results (
             id SERIAL PRIMARY KEY,
-            submission_id INTEGER REFERENCES submissions(id) ON DELETE CASCADE,
+            submission_id INTEGER NOT NULL, -- deleted with the submission by trigger
             analysis_type VARCHAR(50) NOT NULL,
             score INTEGER,
             details JSONB,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_submission_id ON analysis_results(submission_id)")
+    # Latest result per type, and index-only "which types are done" lookups
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_analysis_results_submission_type
+        ON analysis_results(submission_id, analysis_type, created_at DESC)
+    """)
     print("  ✅ Analysis results table created")
 
+def create_analysis_jobs_table(cursor):
+    """Create analysis jobs table"""
+    print("📋 Creating analysis_jobs table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id UUID PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            submission_id INTEGER NOT NULL, -- deleted with the submission by trigger
+            analysis_type VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            score INTEGER,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_user_id ON analysis_jobs(user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_submission_id ON analysis_jobs(submission_id)")
+    print("  ✅ Analysis jobs table created")
+
+def create_bulk_analysis_runs_table(cursor):
+    """Create bulk analysis runs table"""
+    print("📋 Creating bulk_analysis_runs table...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_analysis_runs (
+            id UUID PRIMARY KEY,
+            form_id INTEGER REFERENCES forms(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            analyses TEXT[] NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            concurrency INTEGER NOT NULL,
+            only_missing BOOLEAN NOT NULL,
+            start_after_id INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(30) NOT NULL DEFAULT 'pending',
+            total_submissions INTEGER NOT NULL DEFAULT 0,
+            processed_submissions INTEGER NOT NULL DEFAULT 0,
+            analyses_run INTEGER NOT NULL DEFAULT 0,
+            analyses_skipped INTEGER NOT NULL DEFAULT 0,
+            analyses_failed INTEGER NOT NULL DEFAULT 0,
+            failed_submission_ids INTEGER[] NOT NULL DEFAULT '{}',
+            checkpoint_submission_id INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            updated_at TIMESTAMPTZ DEFAULT now()
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bulk_analysis_runs_form_id ON bulk_analysis_runs(form_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bulk_analysis_runs_user_id ON bulk_analysis_runs(user_id)")
+    print("  ✅ Bulk analysis runs table created")
+
 def create_credit_transactions_table(cursor):
     """Create credit transactions table"""
     print("📋 Creating credit_transactions table...")
@@ -114,21 +181,114 @@ def create_credit_transactions_table(cursor):
     print("  ✅ Credit transactions table created")
 
 def create_activity_log_table(cursor):
-    """Create activity log table"""
+    """Create activity log table (range partitioned by month of created_at)"""
     print("📋 Creating activity_log table...")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS activity_log (
-            id SERIAL PRIMARY KEY,
+            id SERIAL,
             user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             activity_type VARCHAR(50) NOT NULL,
             description TEXT,
             metadata JSONB,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
     """)
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_log_user_id ON activity_log(user_id)")
     print("  ✅ Activity log table created")
 
+def create_rankings_invalidation_triggers(cursor):
+    """Create triggers that notify gateways when rankings change"""
+    print("📋 Creating rankings invalidation triggers...")
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION notify_rankings_invalidate() RETURNS trigger AS $$
+        BEGIN
+            -- On submissions this fires on a partition, so TG_TABLE_NAME is the partition's name
+            IF TG_TABLE_NAME = 'analysis_results' THEN
+                PERFORM pg_notify('rankings_invalidate',
+                    COALESCE((SELECT form_id::text FROM submissions WHERE id = NEW.submission_id), ''));
+            ELSE
+                PERFORM pg_notify('rankings_invalidate', NEW.form_id::text);
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_analysis_results_rankings ON analysis_results")
+    cursor.execute("""
+        CREATE TRIGGER trg_analysis_results_rankings
+            AFTER INSERT OR UPDATE ON analysis_results
+            FOR EACH ROW EXECUTE FUNCTION notify_rankings_invalidate()
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_submissions_rank_rankings ON submissions")
+    cursor.execute("""
+        CREATE TRIGGER trg_submissions_rank_rankings
+            AFTER UPDATE OF rank ON submissions
+            FOR EACH ROW WHEN (OLD.rank IS DISTINCT FROM NEW.rank)
+            EXECUTE FUNCTION notify_rankings_invalidate()
+    """)
+    print("  ✅ Rankings invalidation triggers created")
+
+def create_user_principal_invalidation_triggers(cursor):
+    """Create triggers that notify gateways when a user's tier or is_active change"""
+    print("📋 Creating user principal invalidation triggers...")
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION notify_user_principal_invalidate() RETURNS trigger AS $$
+        BEGIN
+            -- Payload is the JWT subject (email); an email change must drop the old one
+            PERFORM pg_notify('user_principal_invalidate', OLD.email);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_users_principal_invalidate ON users")
+    cursor.execute("""
+        CREATE TRIGGER trg_users_principal_invalidate
+            AFTER UPDATE OF email, tier, is_active ON users
+            FOR EACH ROW WHEN (OLD.email IS DISTINCT FROM NEW.email
+                               OR OLD.tier IS DISTINCT FROM NEW.tier
+                               OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+            EXECUTE FUNCTION notify_user_principal_invalidate()
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_users_principal_delete ON users")
+    cursor.execute("""
+        CREATE TRIGGER trg_users_principal_delete
+            AFTER DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_user_principal_invalidate()
+    """)
+    print("  ✅ User principal invalidation triggers created")
+
+def create_submission_cleanup_trigger(cursor):
+    """Delete a submission's analysis rows with it (foreign keys can't reference a partitioned id)"""
+    print("📋 Creating submission cleanup trigger...")
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION delete_submission_dependents() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM analysis_results WHERE submission_id = OLD.id;
+            DELETE FROM analysis_jobs WHERE submission_id = OLD.id;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS trg_submissions_delete_dependents ON submissions")
+    cursor.execute("""
+        CREATE TRIGGER trg_submissions_delete_dependents
+            AFTER DELETE ON submissions
+            FOR EACH ROW EXECUTE FUNCTION delete_submission_dependents()
+    """)
+    print("  ✅ Submission cleanup trigger created")
+
+def create_initial_partitions(cursor, months_ahead: int = 3):
+    """Default partition plus this month and the next few; scripts/partitions.py keeps them coming"""
+    print("📋 Creating partitions...")
+    this_month = month_start(date.today())
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(cursor, table):
+            print(f"  ⚠️  {table} exists and is not partitioned; leaving it as is")
+            continue
+        created = create_partitions(cursor, table, this_month, add_months(this_month, months_ahead))
+        print(f"  ✅ {table}: {len(created)} new partitions")
+
 def verify_tables(cursor):
     """Verify all tables were created"""
     print("\n🔍 Verifying tables...")
@@ -136,6 +296,7 @@ def verify_tables(cursor):
         SELECT table_name 
         FROM information_schema.tables 
         WHERE table_schema = 'public'
+          AND table_name NOT IN (SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid)
         ORDER BY table_name
     """)
     tables = cursor.fetchall()
@@ -170,12 +331,22 @@ def main():
         create_forms_table(cursor)
         create_submissions_table(cursor)
         create_analysis_results_table(cursor)
+        create_analysis_jobs_table(cursor)
+        create_bulk_analysis_runs_table(cursor)
         create_credit_transactions_table(cursor)
         create_activity_log_table(cursor)
+        create_rankings_invalidation_triggers(cursor)
+        create_user_principal_invalidation_triggers(cursor)
+        create_submission_cleanup_trigger(cursor)
+        create_initial_partitions(cursor)
         
         # Commit changes
         conn.commit()
         
+        # Bring the schema up to the latest migration
+        print("\n📋 Applying migrations...")
+        apply_pending(database_url)
+        
         # Verify tables
         table_count = verify_tables(cursor)
         
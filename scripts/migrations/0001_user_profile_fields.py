@@ -0,0 +1,16 @@
+"""
+Add user profile fields collected at signup (formerly scripts/add_user_fields.py)
+Nullable columns without defaults: a catalog-only change, so the ACCESS
+EXCLUSIVE lock is held only for an instant once it is granted
+"""
+
+def upgrade(m):
+    m.execute("""
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS full_name VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS organization VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS role VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS phone_number VARCHAR(20),
+        ADD COLUMN IF NOT EXISTS use_case VARCHAR(100),
+        ADD COLUMN IF NOT EXISTS organization_size VARCHAR(50)
+    """)
@@ -0,0 +1,22 @@
+"""
+Index revision from scripts/index_audit.py
+New composite/partial indexes are built first, so no query loses its index;
+then the ones they make redundant (or that no query uses) are dropped
+"""
+
+def upgrade(m):
+    m.create_index("idx_forms_user_active", "ON forms (user_id, is_active)")
+    m.create_index("idx_submissions_form_id_id", "ON submissions (form_id, id)")
+    m.create_index("idx_submissions_flagged",
+                   "ON submissions (form_id, submitted_at DESC) WHERE status = 'flagged'")
+    m.create_index("idx_analysis_results_submission_type",
+                   "ON analysis_results (submission_id, analysis_type, created_at DESC)")
+
+    # Duplicates the UNIQUE (email) constraint's index
+    m.drop_index("idx_users_email")
+    # Leading prefixes of the composites above
+    m.drop_index("idx_forms_user_id")
+    m.drop_index("idx_submissions_form_id")
+    m.drop_index("idx_analysis_submission_id")
+    # Low-cardinality and unused; the flagged case has its own partial index
+    m.drop_index("idx_submissions_status")
@@ -0,0 +1,34 @@
+"""
+Persist bulk analysis runs (formerly held in each gateway worker's memory)
+so progress polling and resume work whichever worker a request lands on
+"""
+
+def upgrade(m):
+    m.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_analysis_runs (
+            id UUID PRIMARY KEY,
+            form_id INTEGER REFERENCES forms(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            analyses TEXT[] NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            concurrency INTEGER NOT NULL,
+            only_missing BOOLEAN NOT NULL,
+            start_after_id INTEGER NOT NULL DEFAULT 0,
+            status VARCHAR(30) NOT NULL DEFAULT 'pending',
+            total_submissions INTEGER NOT NULL DEFAULT 0,
+            processed_submissions INTEGER NOT NULL DEFAULT 0,
+            analyses_run INTEGER NOT NULL DEFAULT 0,
+            analyses_skipped INTEGER NOT NULL DEFAULT 0,
+            analyses_failed INTEGER NOT NULL DEFAULT 0,
+            failed_submission_ids INTEGER[] NOT NULL DEFAULT '{}',
+            checkpoint_submission_id INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            updated_at TIMESTAMPTZ DEFAULT now()
+        )
+    """)
+    # Deleting a form cascades here
+    m.create_index("idx_bulk_analysis_runs_form_id", "ON bulk_analysis_runs (form_id)")
+    m.create_index("idx_bulk_analysis_runs_user_id", "ON bulk_analysis_runs (user_id)")
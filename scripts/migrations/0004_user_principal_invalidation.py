@@ -0,0 +1,30 @@
+"""
+Notify gateways when a user's tier or is_active change, so cached
+principals are dropped even when the change is made outside the gateway
+"""
+
+def upgrade(m):
+    m.execute("""
+        CREATE OR REPLACE FUNCTION notify_user_principal_invalidate() RETURNS trigger AS $$
+        BEGIN
+            -- Payload is the JWT subject (email); an email change must drop the old one
+            PERFORM pg_notify('user_principal_invalidate', OLD.email);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    m.execute("DROP TRIGGER IF EXISTS trg_users_principal_invalidate ON users")
+    m.execute("""
+        CREATE TRIGGER trg_users_principal_invalidate
+            AFTER UPDATE OF email, tier, is_active ON users
+            FOR EACH ROW WHEN (OLD.email IS DISTINCT FROM NEW.email
+                               OR OLD.tier IS DISTINCT FROM NEW.tier
+                               OR OLD.is_active IS DISTINCT FROM NEW.is_active)
+            EXECUTE FUNCTION notify_user_principal_invalidate()
+    """)
+    m.execute("DROP TRIGGER IF EXISTS trg_users_principal_delete ON users")
+    m.execute("""
+        CREATE TRIGGER trg_users_principal_delete
+            AFTER DELETE ON users
+            FOR EACH ROW EXECUTE FUNCTION notify_user_principal_invalidate()
+    """)
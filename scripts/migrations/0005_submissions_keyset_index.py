@@ -0,0 +1,8 @@
+"""
+Index for the keyset-paginated submissions listing (newest first, id as the
+tiebreaker). init_db.py creates it for new databases; this builds it on
+existing ones without blocking writes
+"""
+
+def upgrade(m):
+    m.create_index("idx_submissions_form_submitted_id", "ON submissions (form_id, submitted_at, id)")
@@ -0,0 +1,11 @@
+"""
+Drop the indexes from 0002 that only queries the gateway doesn't run justified
+(a dashboard active-forms list and a flagged review queue). forms(user_id)
+comes back first: user deletes cascade through it
+"""
+
+def upgrade(m):
+    m.create_index("idx_forms_user_id", "ON forms (user_id)")
+
+    m.drop_index("idx_forms_user_active")
+    m.drop_index("idx_submissions_flagged")
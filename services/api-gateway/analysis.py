@@ -0,0 +1,84 @@
+"""
+Submission analysis helpers shared by the bulk runner and analysis workers
+Calls the analysis upstreams and records results in analysis_results
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from psycopg.types.json import Jsonb
+
+from database import get_db_connection
+from queries import register, execute, fetchone
+from rankings import invalidate_rankings
+from upstream import PLAGIARISM, AI_DETECTION, call_upstream
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class AnalysisType:
+    """How one kind of analysis maps onto an upstream and the schema"""
+    name: str             # analysis_results.analysis_type
+    service: str          # upstream service name
+    score_field: str      # field of the upstream response holding the score
+    score_scale: float    # multiplier to get a 0-100 integer score
+    column: str           # submissions column holding the latest score
+
+ANALYSIS_TYPES: Dict[str, AnalysisType] = {
+    "plagiarism": AnalysisType("plagiarism", PLAGIARISM, "similarity_score", 1.0, "plagiarism_score"),
+    "ai": AnalysisType("ai_detection", AI_DETECTION, "ai_probability", 100.0, "ai_score"),
+}
+
+INSERT_ANALYSIS_RESULT = register("insert_analysis_result", """
+    INSERT INTO analysis_results (submission_id, analysis_type, score, details)
+    VALUES (%s, %s, %s, %s)
+""")
+# One per analysis; the column name comes from ANALYSIS_TYPES, never from user input
+STORE_SCORE: Dict[str, str] = {
+    analysis: register(
+        f"store_{analysis_type.column}",
+        f"UPDATE submissions SET {analysis_type.column} = %s WHERE id = %s RETURNING form_id"
+    )
+    for analysis, analysis_type in ANALYSIS_TYPES.items()
+}
+
+def submission_text(data: Any) -> str:
+    """Flatten a submission's JSONB answers into the text sent for analysis"""
+    if data is None:
+        return ""
+    if isinstance(data, str):
+        return data
+    if isinstance(data, dict):
+        return "\n".join(submission_text(value) for value in data.values())
+    if isinstance(data, list):
+        return "\n".join(submission_text(value) for value in data)
+    return str(data)
+
+async def call_analysis(analysis: str, submission_id: int, text: str) -> dict:
+    """Run one analysis on the upstream and return its JSON result"""
+    analysis_type = ANALYSIS_TYPES[analysis]
+    response = await call_upstream(
+        analysis_type.service, "POST", "/analyze",
+        json={"submission_id": str(submission_id), "text": text}
+    )
+    response.raise_for_status()
+    return response.json()
+
+async def store_analysis_result(analysis: str, submission_id: int, result: dict) -> int:
+    """Insert an analysis_results row and update the submission's score column"""
+    analysis_type = ANALYSIS_TYPES[analysis]
+    score = int(round(float(result.get(analysis_type.score_field) or 0) * analysis_type.score_scale))
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await execute(cursor, INSERT_ANALYSIS_RESULT,
+                          (submission_id, analysis_type.name, score, Jsonb(result)))
+            row = await fetchone(cursor, STORE_SCORE[analysis], (score, submission_id))
+    if row is not None:
+        await invalidate_rankings(row["form_id"])
+    return score
+
+async def analyze_submission(analysis: str, submission_id: int, text: str) -> int:
+    """Run one analysis end to end and return the stored score"""
+    result = await call_analysis(analysis, submission_id, text)
+    return await store_analysis_result(analysis, submission_id, result)
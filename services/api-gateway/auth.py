@@ -1,17 +1,25 @@
 import os
 import re
+import time
+import hashlib
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
 import bcrypt
-from database import get_db_connection
-from psycopg2.extras import RealDictCursor
+from cache import TTLCache
+from config import settings
+from database import get_db_connection, read_replicas
+from hashing import password_hasher, PasswordHasherBusy
+from queries import register, fetchone
+from user_cache import user_cache
 # Configure logging
 logger = logging.getLogger(__name__)
 
-SECRET_KEY = os.getenv("JWT_SECRET", "dev_jwt_secret_change_in_production")
+DEV_JWT_SECRET = "dev_jwt_secret_change_in_production"
+# Replaced by load_signing_key() on startup
+SECRET_KEY = os.getenv("JWT_SECRET", DEV_JWT_SECRET)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
@@ -21,6 +29,30 @@ DEFAULT_CREDITS = 100
 MIN_PASSWORD_LENGTH = 10
 MAX_PASSWORD_LENGTH = 128
 
+# Verified tokens, keyed by SHA-256 of the token; entries expire at the token's exp
+token_cache = TTLCache(
+    max_size=settings.TOKEN_CACHE_MAX_SIZE,
+    ttl_seconds=settings.TOKEN_CACHE_MAX_TTL_SECONDS
+)
+_token_cache_secret = SECRET_KEY
+
+# Emails whose row this process changed recently: their lookups skip the read
+# replicas until a replica within REPLICA_MAX_LAG_SECONDS must have the change
+_recent_writes: Dict[str, float] = {}
+
+USER_EXISTS = register("user_exists", "SELECT id FROM users WHERE email = %s")
+# Deactivated users can neither log in nor use tokens issued before deactivation
+USER_LOGIN = register(
+    "user_login",
+    "SELECT id, email, password_hash, tier, credits FROM users WHERE email = %s AND is_active IS NOT FALSE"
+)
+# No credits: they change on every metered call and are read fresh where needed
+USER_PRINCIPAL = register(
+    "user_principal",
+    "SELECT id, email, tier FROM users WHERE email = %s AND is_active IS NOT FALSE"
+)
+USER_CREDITS = register("user_credits", "SELECT credits FROM users WHERE id = %s")
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password using bcrypt (handles 72-byte limit)"""
     try:
@@ -52,6 +84,29 @@ def get_password_hash(password: str) -> str:
     hashed = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
     return hashed.decode('utf-8')
 
+def _hasher_busy() -> HTTPException:
+    """503 returned when the password hashing queue is full"""
+    logger.warning("Password hashing queue full, rejecting request")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please try again shortly",
+        headers={"Retry-After": "1"},
+    )
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify password on the hashing worker pool"""
+    try:
+        return await password_hasher.run(verify_password, plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
+async def hash_password(password: str) -> str:
+    """Hash password on the hashing worker pool"""
+    try:
+        return await password_hasher.run(get_password_hash, password)
+    except PasswordHasherBusy:
+        raise _hasher_busy()
+
 def sanitize_for_log(text: str) -> str:
     """Sanitize text for logging to prevent log injection"""
     return text.replace('\n', '').replace('\r', '').replace('\t', ' ')
@@ -78,6 +133,26 @@ def validate_password_strength(password: str) -> Tuple[bool, str]:
         return False, "Password must contain at least one special character (!@#$%^&*()_+-=[]{}|;:,.<>?)"
     return True, "Valid"
 
+def load_signing_key():
+    """Load the JWT secret and warm up the signing path (call on startup)
+
+    JWT_SECRET_FILE (e.g. a mounted Kubernetes secret) takes precedence over JWT_SECRET.
+    """
+    global SECRET_KEY
+    secret_file = os.getenv("JWT_SECRET_FILE")
+    if secret_file:
+        with open(secret_file) as f:
+            SECRET_KEY = f.read().strip()
+    else:
+        SECRET_KEY = os.getenv("JWT_SECRET", DEV_JWT_SECRET)
+    if not SECRET_KEY:
+        raise ValueError("JWT secret is empty")
+    if SECRET_KEY == DEV_JWT_SECRET:
+        logger.warning("Using the development JWT secret; set JWT_SECRET in production")
+    # The first encode/decode loads the crypto backends; pay that before serving traffic
+    jwt.decode(jwt.encode({"sub": "warmup"}, SECRET_KEY, algorithm=ALGORITHM), SECRET_KEY, algorithms=[ALGORITHM])
+    logger.info("JWT signing key loaded")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token with proper expiration"""
     to_encode = data.copy()
@@ -90,15 +165,36 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def decode_access_token(token: str):
+    global _token_cache_secret
+    if not settings.TOKEN_CACHE_ENABLED:
+        try:
+            return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+    
+    # Tokens verified under a previous secret must not be trusted
+    if _token_cache_secret != SECRET_KEY:
+        token_cache.clear()
+        _token_cache_secret = SECRET_KEY
+    
+    digest = hashlib.sha256(token.encode('utf-8')).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return dict(payload)
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        token_cache.set(digest, dict(payload), ttl_seconds=exp - time.time())
+    return payload
 
-def register_user(email: str, password: str, full_name: str, organization: str, role: str, 
-                  phone_number: Optional[str] = None, use_case: Optional[str] = None, 
-                  organization_size: Optional[str] = None) -> dict:
+async def register_user(email: str, password: str, full_name: str, organization: str, role: str, 
+                        phone_number: Optional[str] = None, use_case: Optional[str] = None, 
+                        organization_size: Optional[str] = None) -> dict:
     """Register a new user in the database"""
     logger.info(f"Registration attempt for email: {sanitize_for_log(email)}")
     
@@ -120,34 +216,46 @@ def register_user(email: str, password: str, full_name: str, organization: str,
         )
     
     try:
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Check if user already exists
-                cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-                if cursor.fetchone():
-                    logger.warning(f"Registration failed - email already exists: {email}")
-                    raise HTTPException(
-                        status_code=status.HTTP_400_BAD_REQUEST,
-                        detail="Email already registered"
-                    )
-                
-                # Create new user with all fields
-                hashed_password = get_password_hash(password)
-                cursor.execute(
+        # The connection goes back to the pool before hashing: bcrypt can queue
+        # behind other logins, and must not hold a connection while it waits
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                # Check if user already exists (spares the hash for a duplicate)
+                existing = await fetchone(cursor, USER_EXISTS, (email,))
+        if existing:
+            logger.warning(f"Registration failed - email already exists: {email}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
+        
+        hashed_password = await hash_password(password)
+        
+        # Create new user with all fields
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                # ON CONFLICT: the same email may have registered while we were hashing
+                await cursor.execute(
                     """
                     INSERT INTO users (email, password_hash, full_name, organization, role, 
                                      phone_number, use_case, organization_size, tier, credits)
                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING
                     RETURNING id, email, full_name, organization, role, phone_number, 
                              use_case, organization_size, created_at, tier, credits
                     """,
                     (email, hashed_password, full_name, organization, role, 
                      phone_number, use_case, organization_size, DEFAULT_TIER, DEFAULT_CREDITS)
                 )
-                
-                user = cursor.fetchone()
-                logger.info(f"User registered successfully: {email}")
-                return dict(user)
+                user = await cursor.fetchone()
+        if user is None:
+            logger.warning(f"Registration failed - email already exists: {email}")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered"
+            )
+        logger.info(f"User registered successfully: {email}")
+        return dict(user)
     except HTTPException:
         raise
     except Exception as e:
@@ -157,31 +265,45 @@ def register_user(email: str, password: str, full_name: str, organization: str,
             detail="Registration failed. Please try again."
         )
 
-def authenticate_user(email: str, password: str) -> Optional[dict]:
+async def authenticate_user(email: str, password: str) -> Optional[dict]:
     """Authenticate a user from the database"""
     logger.info(f"Login attempt for email: {sanitize_for_log(email)}")
     
     try:
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT id, email, password_hash, tier, credits FROM users WHERE email = %s",
-                    (email,)
-                )
-                user = cursor.fetchone()
-                
-                # Prevent username enumeration: use same error path for both cases
-                if not user or not verify_password(password, user.get('password_hash', '')):
-                    logger.warning(f"Login failed for: {email}")
-                    return None
-                
-                logger.info(f"Login successful: {email}")
-                return dict(user)
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                user = await fetchone(cursor, USER_LOGIN, (email,))
+        
+        # Verified after the connection is released, so queued hashes don't pin the pool.
+        # Prevent username enumeration: use same error path for both cases
+        if not user or not await check_password(password, user.get('password_hash', '')):
+            logger.warning(f"Login failed for: {email}")
+            return None
+        
+        logger.info(f"Login successful: {email}")
+        return dict(user)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Authentication error for {email}: {e}")
         return None
 
-def get_current_user(token: str) -> dict:
+def _recently_written(email: str) -> bool:
+    written_at = _recent_writes.get(email)
+    if written_at is None:
+        return False
+    if time.monotonic() - written_at > settings.REPLICA_MAX_LAG_SECONDS:
+        del _recent_writes[email]
+        return False
+    return True
+
+async def _fetch_principal(email: str, read_only: bool) -> Optional[dict]:
+    async with get_db_connection(read_only=read_only) as conn:
+        async with conn.cursor() as cursor:
+            user = await fetchone(cursor, USER_PRINCIPAL, (email,))
+    return dict(user) if user is not None else None
+
+async def get_current_user(token: str) -> dict:
     """Get current user from token"""
     payload = decode_access_token(token)
     if payload is None:
@@ -200,23 +322,28 @@ def get_current_user(token: str) -> dict:
             detail="Could not validate credentials"
         )
     
+    if settings.USER_CACHE_ENABLED:
+        cached = await user_cache.get(email)
+        if cached is not None:
+            return cached
+    
     try:
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(
-                    "SELECT id, email, tier, credits FROM users WHERE email = %s",
-                    (email,)
-                )
-                user = cursor.fetchone()
-                
-                if user is None:
-                    logger.warning(f"Token valid but user not found: {email}")
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="User not found"
-                    )
-                
-                return dict(user)
+        version = await user_cache.version(email)
+        user = await _fetch_principal(email, read_only=not _recently_written(email))
+        if user is None and read_replicas:
+            # Registered moments ago (possibly on another worker): the replica may not have it yet
+            user = await _fetch_principal(email, read_only=False)
+        
+        if user is None:
+            logger.warning(f"Token valid but user not found: {email}")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        
+        if settings.USER_CACHE_ENABLED:
+            await user_cache.set(email, user, version)
+        return user
     except HTTPException:
         raise
     except Exception as e:
@@ -225,3 +352,20 @@ def get_current_user(token: str) -> dict:
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to retrieve user information"
         )
+
+async def get_user_credits(user_id: int) -> int:
+    """Current credit balance, read from the primary (never cached)"""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            row = await fetchone(cursor, USER_CREDITS, (user_id,))
+    return row["credits"] if row is not None else 0
+
+async def invalidate_user(email: str):
+    """Drop a cached principal; call whenever the tier changes or the user is deactivated"""
+    if read_replicas:
+        now = time.monotonic()
+        if len(_recent_writes) >= settings.USER_CACHE_MAX_SIZE:
+            for stale in [e for e, t in _recent_writes.items() if now - t > settings.REPLICA_MAX_LAG_SECONDS]:
+                del _recent_writes[stale]
+        _recent_writes[email] = now
+    await user_cache.invalidate(email)
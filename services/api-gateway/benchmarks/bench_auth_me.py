@@ -0,0 +1,117 @@
+"""
+Benchmark: concurrent /api/auth/me throughput, blocking vs async database layer
+
+Compares the legacy path (synchronous psycopg2 pool called from the async
+dependency, blocking the event loop) with the async psycopg pool now used
+by auth.get_current_user. Both runs go through the real FastAPI app in-process.
+
+Usage (from services/api-gateway):
+    DATABASE_URL=postgresql://... python benchmarks/bench_auth_me.py --concurrency 50 --requests 2000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import HTTPException, status
+from psycopg2 import pool
+from psycopg2.extras import RealDictCursor
+
+from main import app
+from auth import get_current_user, create_access_token, decode_access_token
+from database import DATABASE_URL, get_db_connection
+
+BENCH_EMAIL = "bench-auth-me@smartscreen.local"
+
+def make_legacy_get_current_user(legacy_pool):
+    """The pre-async dependency: a synchronous pool query inside an async route"""
+    async def legacy_get_current_user(token: str) -> dict:
+        payload = decode_access_token(token)
+        if payload is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        conn = legacy_pool.getconn()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    "SELECT id, email, tier, credits FROM users WHERE email = %s",
+                    (payload["sub"],)
+                )
+                user = cursor.fetchone()
+            conn.commit()
+        finally:
+            legacy_pool.putconn(conn)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        return dict(user)
+    return legacy_get_current_user
+
+async def ensure_bench_user():
+    """Create the benchmark user if it does not exist yet"""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO users (email, password_hash)
+                VALUES (%s, 'not-a-real-hash')
+                ON CONFLICT (email) DO NOTHING
+                """,
+                (BENCH_EMAIL,)
+            )
+
+async def drive(client: httpx.AsyncClient, token: str, concurrency: int, total: int) -> dict:
+    """Fire `total` requests at /api/auth/me with `concurrency` in flight"""
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.get("/api/auth/me", params={"token": token})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+async def run(concurrency: int, total: int):
+    # Rate limiting would reject most of the run; measure the DB path only
+    app.state.limiter.enabled = False
+    legacy_pool = pool.SimpleConnectionPool(minconn=1, maxconn=concurrency, dsn=DATABASE_URL)
+
+    async with app.router.lifespan_context(app):
+        await ensure_bench_user()
+        token = create_access_token({"sub": BENCH_EMAIL})
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            app.dependency_overrides[get_current_user] = make_legacy_get_current_user(legacy_pool)
+            before = await drive(client, token, concurrency, total)
+            app.dependency_overrides.clear()
+            after = await drive(client, token, concurrency, total)
+
+    legacy_pool.closeall()
+    print(f"concurrency={concurrency}")
+    print(f"  before (sync psycopg2): {before}")
+    print(f"  after  (async pool):    {after}")
+    print(f"  speedup: {after['rps'] / before['rps']:.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.concurrency, args.requests))
@@ -0,0 +1,109 @@
+"""
+Benchmark: gateway cold start to first byte
+
+Starts the gateway from nothing and measures, from process (or container)
+launch, the time until the first response byte arrives on /health and the time
+until /ready returns 200 (pool prewarmed, upstream clients and JWT key
+loaded). Repeats the launch and reports min/median/max as JSON.
+
+Usage (from services/api-gateway):
+    # Local process
+    DATABASE_URL=postgresql://... python benchmarks/bench_cold_start.py --runs 5
+    # Gateway container image
+    DATABASE_URL=postgresql://... python benchmarks/bench_cold_start.py --image smartscreen/api-gateway --runs 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import List, Optional
+
+import httpx
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def launch(args, env: dict) -> subprocess.Popen:
+    if args.image:
+        command = ["docker", "run", "--rm", "--network", args.network, "-p", f"{args.port}:8000"]
+        for key, value in env.items():
+            command += ["-e", f"{key}={value}"]
+        return subprocess.Popen(command + [args.image], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=GATEWAY_DIR, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+def poll_until(client: httpx.Client, path: str, started: float, timeout: float,
+               want_status: Optional[int] = None) -> Optional[float]:
+    """Seconds from `started` until `path` answers (with `want_status`, if given)"""
+    while time.perf_counter() - started < timeout:
+        try:
+            with client.stream("GET", path) as response:
+                # Headers received means the first byte is in
+                if want_status is None or response.status_code == want_status:
+                    return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return None
+
+def measure_once(args, env: dict) -> dict:
+    with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=5.0) as client:
+        started = time.perf_counter()
+        process = launch(args, env)
+        try:
+            first_byte = poll_until(client, "/health", started, args.timeout)
+            ready = poll_until(client, "/ready", started, args.timeout, want_status=200)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return {"first_byte_seconds": first_byte, "ready_seconds": ready}
+
+def summarize(values: List[Optional[float]]) -> dict:
+    measured = [v for v in values if v is not None]
+    if not measured:
+        return {"min": None, "median": None, "max": None, "timeouts": len(values)}
+    return {
+        "min": round(min(measured), 3),
+        "median": round(statistics.median(measured), 3),
+        "max": round(max(measured), 3),
+        "timeouts": len(values) - len(measured),
+    }
+
+def main(args):
+    env = {"DATABASE_URL": args.database_url}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    runs = []
+    for i in range(args.runs):
+        result = measure_once(args, env)
+        runs.append(result)
+        print(f"run {i + 1}: {result}", file=sys.stderr)
+
+    print(json.dumps({
+        "target": args.image or "local-process",
+        "runs": args.runs,
+        "first_byte_seconds": summarize([r["first_byte_seconds"] for r in runs]),
+        "ready_seconds": summarize([r["ready_seconds"] for r in runs]),
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--image", help="gateway image to run with docker instead of a local process")
+    parser.add_argument("--network", default="bridge", help="docker network for --image (must reach the database)")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the gateway")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL or --database-url is required")
+    main(args)
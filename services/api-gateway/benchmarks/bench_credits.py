@@ -0,0 +1,114 @@
+"""
+Benchmark: credit metering under contention on a single account
+
+Fires --calls concurrent metered analysis calls at one account through
+credits.reserve_credits, refunding a --failure-rate fraction as if the
+upstream had failed. The account starts with --balance credits, so some calls
+are expected to be refused once it runs dry. Reports throughput and latency,
+then checks the invariants: the balance never went negative, and both the
+balance and the ledger match the successful reservations minus refunds.
+
+Usage (from services/api-gateway):
+    DATABASE_URL=postgresql://... python benchmarks/bench_credits.py --calls 1000 --balance 800
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credits import InsufficientCredits, reserve_credits, refund_credits
+from database import init_db_pool, close_all_connections, get_db_connection
+
+BENCH_EMAIL = "bench-credits@example.com"
+
+async def reset_account(balance: int) -> int:
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO users (email, password_hash, credits)
+                VALUES (%s, 'not-a-real-hash', %s)
+                ON CONFLICT (email) DO UPDATE SET credits = EXCLUDED.credits
+                RETURNING id
+                """,
+                (BENCH_EMAIL, balance)
+            )
+            user_id = (await cursor.fetchone())["id"]
+            await cursor.execute("DELETE FROM credit_transactions WHERE user_id = %s", (user_id,))
+    return user_id
+
+async def account_state(user_id: int) -> dict:
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT u.credits,
+                       (SELECT COALESCE(sum(amount), 0) FROM credit_transactions WHERE user_id = u.id) AS ledger
+                FROM users u WHERE u.id = %s
+                """,
+                (user_id,)
+            )
+            return await cursor.fetchone()
+
+async def run(calls: int, balance: int, failure_rate: float):
+    await init_db_pool()
+    try:
+        user_id = await reset_account(balance)
+        latencies = []
+        outcomes = {"reserved": 0, "refunded": 0, "insufficient": 0}
+
+        async def metered_call(i: int):
+            start = time.perf_counter()
+            try:
+                await reserve_credits(user_id, 1, f"bench call {i}")
+            except InsufficientCredits:
+                outcomes["insufficient"] += 1
+                latencies.append(time.perf_counter() - start)
+                return
+            outcomes["reserved"] += 1
+            if random.random() < failure_rate:
+                await refund_credits(user_id, 1, f"Refund: bench call {i}")
+                outcomes["refunded"] += 1
+            latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(metered_call(i) for i in range(calls)))
+        elapsed = time.perf_counter() - started
+        state = await account_state(user_id)
+    finally:
+        await close_all_connections()
+
+    latencies.sort()
+    print(f"{calls} concurrent calls on one account in {elapsed:.2f}s: {calls / elapsed:.0f} calls/s")
+    print(f"  p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+    print(f"  {outcomes}")
+    print(f"  balance {balance} -> {state['credits']}, ledger total {state['ledger']}")
+
+    net_debits = outcomes["reserved"] - outcomes["refunded"]
+    problems = []
+    if state["credits"] < 0:
+        problems.append("balance went negative")
+    if state["credits"] != balance - net_debits:
+        problems.append("balance does not match successful reservations")
+    if state["ledger"] != -net_debits:
+        problems.append("ledger does not match the balance change")
+    if outcomes["insufficient"] and state["credits"] > 0 and not outcomes["refunded"]:
+        problems.append("calls were refused while credits remained")
+    if problems:
+        print("FAILED: " + "; ".join(problems))
+        sys.exit(1)
+    print("  invariants hold")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--balance", type=int, default=800)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(run(args.calls, args.balance, args.failure_rate))
@@ -0,0 +1,191 @@
+"""
+Benchmark: write-behind event writer throughput and shutdown durability
+
+throughput: records --events activity_log rows from --concurrency tasks, first
+    with one INSERT per event (EVENT_WRITER_ENABLED=false behaviour), then
+    through the batched writer, and reports events/second for each.
+
+sigterm: starts the gateway with a long flush interval so login events stay
+    buffered, drives logins, sends SIGTERM mid-load and checks that every
+    successful login has its activity_log row once the process has exited.
+    Exits non-zero if any event was lost.
+
+Usage (from services/api-gateway):
+    DATABASE_URL=postgresql://... python benchmarks/bench_event_writer.py throughput --events 20000
+    DATABASE_URL=postgresql://... python benchmarks/bench_event_writer.py sigterm --seconds 5
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+import httpx
+import psycopg
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_EMAIL = "bench-events@example.com"
+BENCH_PASSWORD = "bench-events-password"
+
+def ensure_bench_user(database_url: str) -> int:
+    # Minimum bcrypt cost: this benchmark is about event writes, not hashing
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=4)).decode('utf-8')
+    with psycopg.connect(database_url) as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO users (email, password_hash)
+            VALUES (%s, %s)
+            ON CONFLICT (email) DO UPDATE SET password_hash = EXCLUDED.password_hash
+            RETURNING id
+            """,
+            (BENCH_EMAIL, password_hash)
+        )
+        return cursor.fetchone()[0]
+
+def max_activity_id(database_url: str) -> int:
+    with psycopg.connect(database_url) as conn:
+        return conn.execute("SELECT COALESCE(max(id), 0) FROM activity_log").fetchone()[0]
+
+def count_activity(database_url: str, user_id: int, activity_type: str, after_id: int) -> int:
+    with psycopg.connect(database_url) as conn:
+        return conn.execute(
+            "SELECT count(*) FROM activity_log WHERE user_id = %s AND activity_type = %s AND id > %s",
+            (user_id, activity_type, after_id)
+        ).fetchone()[0]
+
+# ==================== throughput ====================
+
+async def record_events(user_id: int, events: int, concurrency: int, buffered: bool) -> float:
+    from config import settings
+    from event_writer import event_writer, log_activity
+
+    settings.EVENT_WRITER_ENABLED = buffered
+    await event_writer.start()
+    remaining = iter(range(events))
+
+    async def worker():
+        for i in remaining:
+            await log_activity(user_id, "bench_event", None, {"i": i})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    # Count the final flush: the events are only durable once written
+    await event_writer.stop()
+    return time.perf_counter() - started
+
+async def throughput(args, user_id: int):
+    from database import init_db_pool, close_all_connections
+
+    await init_db_pool()
+    try:
+        for label, buffered in (("single-row INSERT", False), ("write-behind COPY", True)):
+            before = max_activity_id(args.database_url)
+            elapsed = await record_events(user_id, args.events, args.concurrency, buffered)
+            written = count_activity(args.database_url, user_id, "bench_event", before)
+            print(f"{label:<18} {args.events / elapsed:>10.0f} events/s  ({written}/{args.events} written)")
+    finally:
+        await close_all_connections()
+
+def run_throughput(args):
+    asyncio.run(throughput(args, ensure_bench_user(args.database_url)))
+
+# ==================== sigterm ====================
+
+async def drive_logins(base_url: str, seconds: float, concurrency: int) -> int:
+    """Log in repeatedly until the gateway goes away; returns the number of 200 responses"""
+    succeeded = 0
+    deadline = time.monotonic() + seconds
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0) as client:
+        async def worker():
+            nonlocal succeeded
+            while time.monotonic() < deadline:
+                try:
+                    response = await client.post(
+                        "/api/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+                    )
+                except httpx.TransportError:
+                    return
+                if response.status_code == 200:
+                    succeeded += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return succeeded
+
+def wait_until_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Gateway did not become ready")
+
+def run_sigterm(args) -> int:
+    user_id = ensure_bench_user(args.database_url)
+    before = max_activity_id(args.database_url)
+    base_url = f"http://127.0.0.1:{args.port}"
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--log-level", "warning"],
+        cwd=GATEWAY_DIR,
+        env={
+            **os.environ,
+            "DATABASE_URL": args.database_url,
+            "RATE_LIMIT_ENABLED": "false",
+            "RATE_LIMIT_REDIS_ENABLED": "false",
+            # Keep everything buffered until shutdown
+            "EVENT_WRITER_FLUSH_INTERVAL": "3600",
+            "EVENT_WRITER_BATCH_SIZE": "1000000",
+            "EVENT_WRITER_MAX_BUFFER": "1000000",
+        },
+    )
+    try:
+        wait_until_ready(base_url)
+
+        async def load_then_terminate() -> int:
+            load = asyncio.create_task(drive_logins(base_url, args.seconds * 2, args.concurrency))
+            await asyncio.sleep(args.seconds)
+            gateway.send_signal(signal.SIGTERM)
+            return await load
+
+        succeeded = asyncio.run(load_then_terminate())
+        exit_code = gateway.wait(timeout=60)
+    finally:
+        if gateway.poll() is None:
+            gateway.kill()
+
+    written = count_activity(args.database_url, user_id, "login", before)
+    print(f"gateway exit code: {exit_code}")
+    print(f"successful logins: {succeeded}")
+    print(f"login events written: {written}")
+    if written < succeeded:
+        print(f"LOST {succeeded - written} events")
+        return 1
+    print("no events lost")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["throughput", "sigterm"])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5.0, help="load before SIGTERM (sigterm mode)")
+    parser.add_argument("--port", type=int, default=9300)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL or --database-url is required")
+    os.environ["DATABASE_URL"] = args.database_url
+    if args.mode == "throughput":
+        run_throughput(args)
+    else:
+        sys.exit(run_sigterm(args))
@@ -0,0 +1,114 @@
+"""
+Benchmark: registered (prepared) queries vs ad hoc cursor.execute
+
+Runs the gateway's hot registered queries (principal lookup, login lookup,
+form ownership check, first submissions page) --iterations times each on a
+dedicated connection, three ways:
+  adhoc     cursor.execute with preparing disabled: parse + plan every call
+  implicit  cursor.execute with psycopg's default prepare_threshold (prepares
+            a statement after it has run a few times on the connection)
+  registry  queries.execute: prepared on first use, then bind + execute only
+Reports per-query round-trip latency (p50/p99/mean) for each mode.
+
+Usage (from services/api-gateway):
+    DATABASE_URL=postgresql://... python benchmarks/bench_prepared_queries.py --iterations 5000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+import queries
+from auth import USER_LOGIN, USER_PRINCIPAL
+from database import DATABASE_URL, init_db_pool, close_all_connections, get_db_connection
+from submissions import FORM_OWNER, SUBMISSIONS_PAGE
+
+BENCH_EMAIL = "bench-prepared@example.com"
+PAGE_SIZE = 50
+
+async def seed() -> tuple:
+    """The bench user and one form of theirs; returns (user_id, form_id)"""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO users (email, password_hash)
+                VALUES (%s, 'not-a-real-hash')
+                ON CONFLICT (email) DO UPDATE SET email = EXCLUDED.email
+                RETURNING id
+                """,
+                (BENCH_EMAIL,)
+            )
+            user_id = (await cursor.fetchone())["id"]
+            await cursor.execute("SELECT id FROM forms WHERE user_id = %s LIMIT 1", (user_id,))
+            form = await cursor.fetchone()
+            if form is None:
+                await cursor.execute(
+                    """
+                    INSERT INTO forms (user_id, title, platform, form_id)
+                    VALUES (%s, 'Prepared statement benchmark', 'bench', 'bench')
+                    RETURNING id
+                    """,
+                    (user_id,)
+                )
+                form = await cursor.fetchone()
+    return user_id, form["id"]
+
+async def time_mode(conn, mode: str, name: str, params: tuple, iterations: int) -> list:
+    sql = queries.QUERIES[name]
+    latencies = []
+    async with conn.cursor() as cursor:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            if mode == "registry":
+                await queries.execute(cursor, name, params)
+            elif mode == "adhoc":
+                await cursor.execute(sql, params, prepare=False)
+            else:
+                await cursor.execute(sql, params)
+            await cursor.fetchall()
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def run(iterations: int):
+    await init_db_pool()
+    try:
+        user_id, form_id = await seed()
+        cases = [
+            (USER_PRINCIPAL, (BENCH_EMAIL,)),
+            (USER_LOGIN, (BENCH_EMAIL,)),
+            (FORM_OWNER, (form_id, user_id)),
+            (SUBMISSIONS_PAGE, (form_id, PAGE_SIZE + 1)),
+        ]
+        results = {}
+        for mode in ("adhoc", "implicit", "registry"):
+            # A new connection per mode, so no mode inherits another's prepared statements
+            async with await psycopg.AsyncConnection.connect(DATABASE_URL, row_factory=dict_row) as conn:
+                for name, params in cases:
+                    results[(mode, name)] = await time_mode(conn, mode, name, params, iterations)
+    finally:
+        await close_all_connections()
+
+    print(f"{iterations} sequential executions per query and mode, one connection per mode")
+    for name, _ in cases:
+        print(f"\n{name}")
+        baseline = statistics.mean(results[("adhoc", name)])
+        for mode in ("adhoc", "implicit", "registry"):
+            latencies = sorted(results[(mode, name)])
+            mean = statistics.mean(latencies)
+            print(f"  {mode:<9} p50={statistics.median(latencies) * 1000:.3f}ms "
+                  f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.3f}ms "
+                  f"mean={mean * 1000:.3f}ms ({(baseline - mean) / baseline:+.1%} vs adhoc)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
@@ -0,0 +1,144 @@
+"""
+Stub upstream services for gateway benchmarks
+
+Stands in for forms, plagiarism, AI-detection and ranking with canned JSON
+responses, a configurable latency (mean plus uniform jitter) and a random
+5xx error rate. All four run in one process on consecutive ports.
+
+Usage (from services/api-gateway):
+    python benchmarks/stub_upstreams.py --base-port 9101 --latency-ms 20 --jitter-ms 5 --error-rate 0.01
+"""
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# Service name -> gateway setting holding its base URL, in port order
+STUB_SERVICES = {
+    "forms": "FORMS_SERVICE_URL",
+    "plagiarism": "PLAGIARISM_SERVICE_URL",
+    "ai_detection": "AI_DETECTION_SERVICE_URL",
+    "ranking": "RANKING_SERVICE_URL",
+}
+
+@dataclass
+class StubBehaviour:
+    latency_ms: float = 20.0
+    jitter_ms: float = 5.0
+    error_rate: float = 0.0
+
+    async def delay_or_fail(self):
+        """Sleep for the configured latency; returns a 503 response for injected errors"""
+        delay = max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms))
+        await asyncio.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse(status_code=503, content={"error": "injected failure"})
+        return None
+
+def stub_env(base_port: int, host: str = "127.0.0.1") -> dict:
+    """Gateway environment pointing each upstream at its stub"""
+    return {
+        setting: f"http://{host}:{base_port + i}"
+        for i, setting in enumerate(STUB_SERVICES.values())
+    }
+
+def build_stub_app(service: str, behaviour: StubBehaviour) -> FastAPI:
+    """A minimal app implementing the endpoints the gateway calls on `service`"""
+    app = FastAPI(title=f"stub-{service}")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "service": service}
+
+    if service == "forms":
+        @app.get("/forms")
+        async def list_forms(request: Request):
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            user_id = request.headers.get("X-User-ID")
+            return [
+                {"id": i, "user_id": user_id, "title": f"Form {i}", "platform": "google"}
+                for i in range(1, 21)
+            ]
+
+        @app.post("/connect/{platform}")
+        async def connect(platform: str, request: Request):
+            body = await request.body()
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            return {"connected": True, "platform": platform, "bytes_received": len(body)}
+
+    if service in ("plagiarism", "ai_detection"):
+        field = "similarity_score" if service == "plagiarism" else "ai_probability"
+
+        def score() -> float:
+            # The plagiarism service reports a 0-100 percentage, AI detection a 0-1 probability
+            if service == "plagiarism":
+                return round(random.random() * 100, 1)
+            return round(random.random(), 3)
+
+        @app.post("/analyze")
+        async def analyze(request: Request):
+            payload = await request.json()
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            return {"submission_id": payload.get("submission_id"), field: score()}
+
+        @app.get("/results/{submission_id}")
+        async def results(submission_id: int):
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            return {"submission_id": submission_id, field: score()}
+
+    if service == "ranking":
+        @app.get("/rankings/{form_id}")
+        async def rankings(form_id: int):
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            return {
+                "form_id": form_id,
+                "rankings": [{"submission_id": i, "rank": i, "score": 100 - i} for i in range(1, 101)],
+            }
+
+        @app.get("/scores/{submission_id}")
+        async def scores(submission_id: int):
+            failure = await behaviour.delay_or_fail()
+            if failure:
+                return failure
+            return {"submission_id": submission_id, "quality_score": random.randint(0, 100)}
+
+    return app
+
+async def serve_stubs(base_port: int, behaviour: StubBehaviour, host: str = "127.0.0.1"):
+    """Run all stub services until cancelled"""
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            build_stub_app(service, behaviour), host=host, port=base_port + i,
+            log_level="warning", access_log=False,
+        ))
+        for i, service in enumerate(STUB_SERVICES)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=9101)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(serve_stubs(
+        args.base_port,
+        StubBehaviour(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate),
+        host=args.host,
+    ))
@@ -0,0 +1,292 @@
+"""
+Form-wide bulk analysis for the API Gateway
+Runs the chosen analyses over every submission of a form in chunks under a
+concurrency cap, checkpointing after each chunk so failed runs can resume.
+Run state lives in bulk_analysis_runs, so any gateway worker can report on a
+run or resume it
+"""
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+import psycopg
+from psycopg_pool import PoolTimeout
+
+from analysis import ANALYSIS_TYPES, analyze_submission, submission_text
+from config import settings
+from credits import InsufficientCredits, reserve_credits, refund_credits
+from database import get_db_connection
+from queries import register, fetchone, fetchall
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Failed submission ids kept per run for reporting
+MAX_REPORTED_FAILURES = 100
+
+RUN_COLUMNS = """
+    id::text AS id, form_id, user_id, analyses, chunk_size, concurrency, only_missing,
+    start_after_id, status, total_submissions, processed_submissions, analyses_run,
+    analyses_skipped, analyses_failed, failed_submission_ids, checkpoint_submission_id, error,
+    EXTRACT(EPOCH FROM started_at)::float8 AS started_at,
+    EXTRACT(EPOCH FROM finished_at)::float8 AS finished_at,
+    EXTRACT(EPOCH FROM now() - updated_at)::float8 AS idle_seconds
+"""
+
+REMAINING_SUBMISSIONS = register(
+    "bulk_remaining_submissions",
+    "SELECT count(*) AS total FROM submissions WHERE form_id = %s AND id > %s"
+)
+NEXT_CHUNK = register("bulk_next_chunk", """
+    SELECT s.id, s.data, COALESCE(d.done, '{}') AS done
+    FROM submissions s
+    -- Per-row aggregate: submissions' key is (id, submitted_at), so GROUP BY s.id
+    -- would not cover s.data, and the LIMIT applies before any aggregation
+    CROSS JOIN LATERAL (
+        SELECT array_agg(DISTINCT a.analysis_type) AS done
+        FROM analysis_results a
+        WHERE a.submission_id = s.id
+    ) d
+    WHERE s.form_id = %s AND s.id > %s
+    ORDER BY s.id
+    LIMIT %s
+""")
+
+@dataclass
+class BulkAnalysisRun:
+    """Progress of one bulk analysis run"""
+    id: str
+    form_id: int
+    user_id: int
+    analyses: List[str]
+    chunk_size: int
+    concurrency: int
+    only_missing: bool
+    start_after_id: int
+    status: str = "pending"  # pending, running, completed, completed_with_errors, failed
+    total_submissions: int = 0
+    processed_submissions: int = 0
+    analyses_run: int = 0
+    analyses_skipped: int = 0
+    analyses_failed: int = 0
+    failed_submission_ids: List[int] = field(default_factory=list)
+    checkpoint_submission_id: int = 0
+    error: Optional[str] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    last_saved: float = 0.0
+
+    def to_dict(self) -> dict:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "run_id": self.id,
+            "form_id": self.form_id,
+            "analyses": self.analyses,
+            "status": self.status,
+            "total_submissions": self.total_submissions,
+            "processed_submissions": self.processed_submissions,
+            "progress_percent": round(self.processed_submissions / self.total_submissions * 100, 2)
+            if self.total_submissions else 100.0,
+            "analyses_run": self.analyses_run,
+            "analyses_skipped": self.analyses_skipped,
+            "analyses_failed": self.analyses_failed,
+            "failed_submission_ids": self.failed_submission_ids,
+            "checkpoint_submission_id": self.checkpoint_submission_id,
+            "elapsed_seconds": round(elapsed, 2),
+            "submissions_per_second": round(self.processed_submissions / elapsed, 2) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+# Runs executing in this process; progress is saved to bulk_analysis_runs as they go
+_runs: Dict[str, BulkAnalysisRun] = {}
+_tasks: Dict[str, asyncio.Task] = {}
+
+async def _insert_run(run: BulkAnalysisRun):
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                INSERT INTO bulk_analysis_runs
+                    (id, form_id, user_id, analyses, chunk_size, concurrency, only_missing,
+                     start_after_id, checkpoint_submission_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (run.id, run.form_id, run.user_id, run.analyses, run.chunk_size, run.concurrency,
+                 run.only_missing, run.start_after_id, run.checkpoint_submission_id)
+            )
+
+async def _save_run(run: BulkAnalysisRun):
+    """Write the run's progress; logged rather than raised, so a DB blip doesn't stop the run"""
+    run.last_saved = time.monotonic()
+    try:
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    UPDATE bulk_analysis_runs
+                    SET status = %s, total_submissions = %s, processed_submissions = %s,
+                        analyses_run = %s, analyses_skipped = %s, analyses_failed = %s,
+                        failed_submission_ids = %s, checkpoint_submission_id = %s, error = %s,
+                        started_at = to_timestamp(%s), finished_at = to_timestamp(%s),
+                        updated_at = now()
+                    WHERE id = %s
+                    """,
+                    (run.status, run.total_submissions, run.processed_submissions,
+                     run.analyses_run, run.analyses_skipped, run.analyses_failed,
+                     run.failed_submission_ids, run.checkpoint_submission_id, run.error,
+                     run.started_at, run.finished_at, run.id)
+                )
+    except (psycopg.Error, PoolTimeout) as e:
+        logger.warning(f"Bulk run {run.id}: could not save progress: {e}")
+
+async def _count_submissions(form_id: int, after_id: int) -> int:
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            return (await fetchone(cursor, REMAINING_SUBMISSIONS, (form_id, after_id)))["total"]
+
+async def _fetch_chunk(form_id: int, after_id: int, limit: int) -> List[dict]:
+    """Next chunk of submissions by id, with the analysis types already stored"""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            return await fetchall(cursor, NEXT_CHUNK, (form_id, after_id, limit))
+
+async def _process_submission(run: BulkAnalysisRun, submission: dict, semaphore: asyncio.Semaphore):
+    """Run every requested analysis for one submission"""
+    text = submission_text(submission["data"])
+    failed = False
+    for analysis in run.analyses:
+        if run.only_missing and ANALYSIS_TYPES[analysis].name in submission["done"]:
+            run.analyses_skipped += 1
+            continue
+        async with semaphore:
+            description = f"{analysis} analysis of submission {submission['id']} (bulk run {run.id})"
+            await reserve_credits(run.user_id, settings.ANALYSIS_CREDIT_COST, description)
+            try:
+                await analyze_submission(analysis, submission["id"], text)
+                run.analyses_run += 1
+            except (httpx.HTTPError, psycopg.Error, ValueError) as e:
+                logger.warning(f"Bulk run {run.id}: {analysis} failed for submission {submission['id']}: {e}")
+                await refund_credits(run.user_id, settings.ANALYSIS_CREDIT_COST, f"Refund: {description}")
+                run.analyses_failed += 1
+                failed = True
+            except asyncio.CancelledError:
+                # Stopped mid-call (a sibling failed, or shutdown): give the reservation back
+                await refund_credits(run.user_id, settings.ANALYSIS_CREDIT_COST, f"Refund: {description}")
+                raise
+    if failed and len(run.failed_submission_ids) < MAX_REPORTED_FAILURES:
+        run.failed_submission_ids.append(submission["id"])
+    run.processed_submissions += 1
+    if time.monotonic() - run.last_saved >= settings.BULK_ANALYSIS_SAVE_INTERVAL:
+        await _save_run(run)
+
+async def _process_chunk(run: BulkAnalysisRun, chunk: List[dict], semaphore: asyncio.Semaphore):
+    """Process a chunk concurrently; the first failure cancels the rest of the chunk"""
+    tasks = [asyncio.create_task(_process_submission(run, s, semaphore)) for s in chunk]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Without this the siblings keep reserving credits and calling upstreams
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _execute(run: BulkAnalysisRun):
+    """Work through the form chunk by chunk"""
+    run.status = "running"
+    run.started_at = time.time()
+    semaphore = asyncio.Semaphore(run.concurrency)
+    try:
+        run.total_submissions = await _count_submissions(run.form_id, run.start_after_id)
+        await _save_run(run)
+        after_id = run.start_after_id
+        while True:
+            chunk = await _fetch_chunk(run.form_id, after_id, run.chunk_size)
+            if not chunk:
+                break
+            await _process_chunk(run, chunk, semaphore)
+            after_id = chunk[-1]["id"]
+            run.checkpoint_submission_id = after_id
+            await _save_run(run)
+        run.status = "completed_with_errors" if run.analyses_failed else "completed"
+    except asyncio.CancelledError:
+        run.status = "failed"
+        run.error = "Interrupted by gateway shutdown; resume to continue from the checkpoint"
+        raise
+    except InsufficientCredits:
+        run.status = "failed"
+        run.error = "Insufficient credits; top up and resume to continue from the checkpoint"
+    except Exception as e:
+        # Checkpoint stays at the last fully processed chunk for resume
+        logger.error(f"Bulk run {run.id} failed: {e}")
+        run.status = "failed"
+        run.error = "Bulk analysis failed; resume to continue from the checkpoint"
+    finally:
+        run.finished_at = time.time()
+        await _save_run(run)
+        _tasks.pop(run.id, None)
+        _runs.pop(run.id, None)
+        summary = run.to_dict()
+        logger.info(
+            f"Bulk run {run.id} {run.status}: {run.processed_submissions} submissions "
+            f"in {summary['elapsed_seconds']}s ({summary['submissions_per_second']}/s)"
+        )
+
+async def get_run(run_id: str, form_id: int, user_id: int) -> Optional[BulkAnalysisRun]:
+    """Look up a run owned by the user for the form, whichever worker is executing it"""
+    run = _runs.get(run_id)
+    if run is not None:
+        # Executing here: fresher than the last saved progress
+        return run if run.form_id == form_id and run.user_id == user_id else None
+    try:
+        uuid.UUID(run_id)
+    except ValueError:
+        return None
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT {RUN_COLUMNS} FROM bulk_analysis_runs WHERE id = %s AND form_id = %s AND user_id = %s",
+                (run_id, form_id, user_id)
+            )
+            row = await cursor.fetchone()
+    if row is None:
+        return None
+    idle_seconds = row.pop("idle_seconds")
+    run = BulkAnalysisRun(**row)
+    if run.status in ("pending", "running") and idle_seconds > settings.BULK_ANALYSIS_STALE_SECONDS:
+        # The worker running it died without recording the outcome
+        run.status = "failed"
+        run.error = "Interrupted; resume to continue from the checkpoint"
+    return run
+
+async def start_bulk_analysis(form_id: int, user_id: int, analyses: List[str], chunk_size: int,
+                              concurrency: int, only_missing: bool = True,
+                              start_after_id: int = 0) -> BulkAnalysisRun:
+    """Record a run and start it in the background"""
+    run = BulkAnalysisRun(
+        id=str(uuid.uuid4()),
+        form_id=form_id,
+        user_id=user_id,
+        analyses=analyses,
+        chunk_size=chunk_size,
+        concurrency=concurrency,
+        only_missing=only_missing,
+        start_after_id=start_after_id,
+        checkpoint_submission_id=start_after_id,
+    )
+    await _insert_run(run)
+    _runs[run.id] = run
+    _tasks[run.id] = asyncio.create_task(_execute(run))
+    logger.info(f"Bulk run {run.id} started for form {form_id} ({', '.join(analyses)})")
+    return run
+
+async def cancel_all_runs():
+    """Stop in-flight runs (call on shutdown); their checkpoints remain resumable"""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
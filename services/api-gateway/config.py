@@ -26,8 +26,126 @@ class Settings(BaseSettings):
     RANKING_SERVICE_URL: str = "http://ranking-service:8004"
     FILE_PROCESSING_URL: str = "http://file-processing:8005"
     
+    # Upstream HTTP clients (one pooled client per service)
+    UPSTREAM_HTTP2: bool = False  # requires httpx[http2]
+    UPSTREAM_CONNECT_TIMEOUT: float = 5.0
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_BREAKER_HALF_OPEN_CALLS: int = 1
+    UPSTREAM_RETRY_BACKOFF_SECONDS: float = 0.1
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = 20
+    UPSTREAM_COALESCE_ENABLED: bool = True  # single-flight identical concurrent GETs
+    FORMS_SERVICE_TIMEOUT: float = 30.0
+    FORMS_SERVICE_MAX_CONNECTIONS: int = 100
+    FORMS_SERVICE_MAX_KEEPALIVE: int = 20
+    FORMS_SERVICE_BREAKER_FAILURE_THRESHOLD: int = 5
+    FORMS_SERVICE_BREAKER_RECOVERY_SECONDS: float = 30.0
+    FORMS_SERVICE_RETRIES: int = 2  # idempotent GETs only
+    FORMS_SERVICE_HEDGE_PERCENTILE: float = 95.0  # 0 disables hedging
+    PLAGIARISM_SERVICE_TIMEOUT: float = 60.0
+    PLAGIARISM_SERVICE_MAX_CONNECTIONS: int = 50
+    PLAGIARISM_SERVICE_MAX_KEEPALIVE: int = 10
+    PLAGIARISM_SERVICE_BREAKER_FAILURE_THRESHOLD: int = 5
+    PLAGIARISM_SERVICE_BREAKER_RECOVERY_SECONDS: float = 30.0
+    PLAGIARISM_SERVICE_RETRIES: int = 1
+    PLAGIARISM_SERVICE_HEDGE_PERCENTILE: float = 0.0
+    AI_DETECTION_SERVICE_TIMEOUT: float = 60.0
+    AI_DETECTION_SERVICE_MAX_CONNECTIONS: int = 50
+    AI_DETECTION_SERVICE_MAX_KEEPALIVE: int = 10
+    AI_DETECTION_SERVICE_BREAKER_FAILURE_THRESHOLD: int = 5
+    AI_DETECTION_SERVICE_BREAKER_RECOVERY_SECONDS: float = 30.0
+    AI_DETECTION_SERVICE_RETRIES: int = 1
+    AI_DETECTION_SERVICE_HEDGE_PERCENTILE: float = 0.0
+    RANKING_SERVICE_TIMEOUT: float = 30.0
+    RANKING_SERVICE_MAX_CONNECTIONS: int = 100
+    RANKING_SERVICE_MAX_KEEPALIVE: int = 20
+    RANKING_SERVICE_BREAKER_FAILURE_THRESHOLD: int = 5
+    RANKING_SERVICE_BREAKER_RECOVERY_SECONDS: float = 30.0
+    RANKING_SERVICE_RETRIES: int = 2
+    RANKING_SERVICE_HEDGE_PERCENTILE: float = 95.0
+    
+    # Submission detail fan-out deadlines (seconds)
+    DETAIL_PLAGIARISM_TIMEOUT: float = 2.0
+    DETAIL_AI_DETECTION_TIMEOUT: float = 2.0
+    DETAIL_RANKING_TIMEOUT: float = 2.0
+    DETAIL_DATABASE_TIMEOUT: float = 1.0
+    DETAIL_TOTAL_BUDGET: float = 2.5
+    
+    # Form-wide bulk analysis
+    BULK_ANALYSIS_CHUNK_SIZE: int = 100
+    BULK_ANALYSIS_CONCURRENCY: int = 8
+    BULK_ANALYSIS_MAX_CONCURRENCY: int = 32
+    BULK_ANALYSIS_SAVE_INTERVAL: float = 2.0  # seconds between progress writes to bulk_analysis_runs
+    BULK_ANALYSIS_STALE_SECONDS: float = 300.0  # a running run not saved for this long is reported failed (resumable)
+    
+    # Analysis job queue
+    JOB_QUEUE_BACKEND: str = "memory"  # 'memory' or 'rabbitmq' (RABBITMQ_URL)
+    JOB_QUEUE_NAME: str = "analysis-jobs"
+    JOB_WORKERS: int = 4  # jobs consumed concurrently per gateway process (0 = publish only)
+    JOB_SHUTDOWN_GRACE_SECONDS: float = 15.0  # then unfinished jobs are failed and refunded; keep under GATEWAY_GRACEFUL_TIMEOUT
+    
+    # Rankings response cache
+    RANKINGS_CACHE_ENABLED: bool = True
+    RANKINGS_CACHE_MAX_SIZE: int = 5000
+    RANKINGS_CACHE_FRESH_SECONDS: float = 30.0
+    RANKINGS_CACHE_STALE_SECONDS: float = 300.0  # serve stale (and revalidate) up to this age
+    RANKINGS_CACHE_REDIS_ENABLED: bool = False
+    RANKINGS_CACHE_LISTEN: bool = True  # LISTEN for invalidations (needs a direct, non-pgbouncer DSN)
+    
+    # Password hashing worker pool
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 32
+    PASSWORD_HASH_USE_PROCESSES: bool = False
+    
+    # User principal cache (get_current_user)
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_MAX_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60.0
+    USER_CACHE_REDIS_ENABLED: bool = False  # share entries/invalidations across replicas via REDIS_URL
+    USER_CACHE_LISTEN: bool = True  # LISTEN for tier/is_active changes made outside the gateway
+    
+    # Verified JWT cache (decode_access_token)
+    TOKEN_CACHE_ENABLED: bool = True
+    TOKEN_CACHE_MAX_SIZE: int = 10000
+    TOKEN_CACHE_MAX_TTL_SECONDS: float = 60 * 60 * 24
+    
     # Rate limiting
     RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_REDIS_ENABLED: bool = True  # share windows across workers/pods via REDIS_URL
+    RATE_LIMIT_SYNC_INTERVAL: float = 0.5  # seconds between Redis syncs per key
+    RATE_LIMIT_SYNC_BATCH: int = 10  # or sync sooner after this many local hits
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    
+    # Process model (gunicorn.conf.py) and per-worker database pool sizing
+    GATEWAY_WORKERS: int = 1  # worker processes per pod; set by gunicorn.conf.py
+    GATEWAY_MAX_REPLICAS: int = 1  # most pods running at once (the HPA's maxReplicas)
+    DB_CONNECTION_BUDGET: int = 0  # Postgres connections for all gateway workers together; 0 = no budget
+    DB_POOL_MIN_CONNECTIONS: int = 2
+    DB_POOL_MAX_CONNECTIONS: int = 20  # per worker; also the cap when a budget is set
+    
+    # Read replicas: get_db_connection(read_only=True) goes to a replica when one is fresh enough
+    DATABASE_REPLICA_URLS: str = ""  # comma-separated DSNs; empty sends every query to the primary
+    REPLICA_MAX_LAG_SECONDS: float = 2.0  # replicas further behind are skipped until they catch up
+    REPLICA_LAG_CHECK_INTERVAL: float = 1.0
+    
+    # Named hot-path queries (queries.py): server-side prepared once per pooled connection
+    DB_PREPARED_STATEMENTS: bool = True  # false: no statement is ever prepared (transaction-mode pooler without support)
+    
+    # Write-behind activity_log / credit_transactions writer
+    EVENT_WRITER_ENABLED: bool = True  # False writes each event with its own INSERT
+    EVENT_WRITER_BATCH_SIZE: int = 500  # flush as soon as this many events are buffered
+    EVENT_WRITER_FLUSH_INTERVAL: float = 1.0  # otherwise flush at least this often (seconds)
+    EVENT_WRITER_MAX_BUFFER: int = 10000  # producers wait when this many events are unwritten
+    EVENT_WRITER_ENQUEUE_TIMEOUT: float = 2.0
+    EVENT_WRITER_SPILL_DIR: str = "/tmp/gateway-event-spill"  # unwritten events at shutdown; replayed on start
+    
+    # Credit metering (credits.py)
+    CREDIT_METERING_ENABLED: bool = True
+    ANALYSIS_CREDIT_COST: int = 1  # credits reserved per plagiarism / AI analysis
+    
+    # Readiness probe (/ready)
+    READY_CHECK_TIMEOUT: float = 2.0
+    READY_REQUIRE_REDIS: bool = False  # Redis-backed features fall back to local state when it is down
+    READY_REQUIRED_UPSTREAMS: str = ""  # comma-separated upstreams that must answer /health, e.g. "forms"
     
     class Config:
         env_file = ".env"
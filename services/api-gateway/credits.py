@@ -0,0 +1,89 @@
+"""
+Credit metering for analysis calls
+Credits are reserved with one conditional UPDATE that also writes the
+credit_transactions ledger entry in the same statement, so concurrent calls on
+one account can neither overdraw it nor leave the ledger out of step. A failed
+analysis is refunded the same way
+"""
+import logging
+from typing import Optional
+
+import psycopg
+from fastapi import HTTPException, status
+
+from config import settings
+from database import get_db_connection
+from queries import register, execute, fetchone
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# credit_transactions.transaction_type values
+DEBIT = "usage"
+REFUND = "refund"
+
+# Row lock is held only for this statement: no read-then-write window to race in
+RESERVE_QUERY = register("credits_reserve", """
+    WITH debit AS (
+        UPDATE users
+        SET credits = credits - %(amount)s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(user_id)s AND credits >= %(amount)s
+        RETURNING id, credits
+    ), ledger AS (
+        INSERT INTO credit_transactions (user_id, amount, transaction_type, description)
+        SELECT id, -%(amount)s, %(transaction_type)s, %(description)s FROM debit
+    )
+    SELECT credits FROM debit
+""")
+
+REFUND_QUERY = register("credits_refund", """
+    WITH credit AS (
+        UPDATE users
+        SET credits = credits + %(amount)s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(user_id)s
+        RETURNING id
+    )
+    INSERT INTO credit_transactions (user_id, amount, transaction_type, description)
+    SELECT id, %(amount)s, %(transaction_type)s, %(description)s FROM credit
+""")
+
+class InsufficientCredits(HTTPException):
+    """402 when the account cannot cover the call"""
+
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_402_PAYMENT_REQUIRED,
+            detail="Insufficient credits"
+        )
+
+async def reserve_credits(user_id: int, amount: int, description: str) -> Optional[int]:
+    """Debit `amount` credits or raise InsufficientCredits; returns the remaining balance
+
+    Returns None without touching the database when metering is disabled.
+    """
+    if not settings.CREDIT_METERING_ENABLED or amount <= 0:
+        return None
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            row = await fetchone(cursor, RESERVE_QUERY, {
+                "user_id": user_id, "amount": amount,
+                "transaction_type": DEBIT, "description": description,
+            })
+    if row is None:
+        raise InsufficientCredits()
+    return row["credits"]
+
+async def refund_credits(user_id: int, amount: int, description: str):
+    """Give back a reservation whose analysis did not complete; never raises"""
+    if not settings.CREDIT_METERING_ENABLED or amount <= 0:
+        return
+    try:
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                await execute(cursor, REFUND_QUERY, {
+                    "user_id": user_id, "amount": amount,
+                    "transaction_type": REFUND, "description": description,
+                })
+    except (psycopg.Error, RuntimeError) as e:
+        # The debit is in the ledger; this line is what reconciliation needs
+        logger.error(f"Credit refund failed (user={user_id}, amount={amount}, {description}): {e}")
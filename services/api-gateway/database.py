@@ -1,94 +1,281 @@
 """
 Database connection and utilities for Neon PostgreSQL
-Implements connection pooling for better performance
+Implements async connection pooling so queries never block the event loop.
+Optional read replicas get their own pools; call sites opt in per query with
+get_db_connection(read_only=True), and fall back to the primary while every
+replica is lagging or down
 """
 import os
+import time
+import asyncio
 import logging
-from contextlib import contextmanager
-import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import psycopg
+from psycopg.conninfo import conninfo_to_dict
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from config import settings
+from metrics import DB_POOL_WAIT, DB_READ_ROUTING
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Get database URL from environment variable
+# Get database URL from environment variable (checked when the pool is opened)
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is not set!")
+def per_worker_max_connections() -> int:
+    """Pool size for this worker: an even share of the cluster-wide connection budget"""
+    if settings.DB_CONNECTION_BUDGET <= 0:
+        return settings.DB_POOL_MAX_CONNECTIONS
+    workers = settings.GATEWAY_WORKERS * settings.GATEWAY_MAX_REPLICAS
+    # Each worker also holds direct LISTEN connections for rankings and principal invalidation
+    reserved = int(settings.RANKINGS_CACHE_LISTEN) + int(settings.USER_CACHE_LISTEN)
+    share = settings.DB_CONNECTION_BUDGET // workers - reserved
+    if share < settings.DB_POOL_MIN_CONNECTIONS:
+        logger.warning(
+            f"DB_CONNECTION_BUDGET={settings.DB_CONNECTION_BUDGET} is too small for {workers} workers; "
+            f"using DB_POOL_MIN_CONNECTIONS={settings.DB_POOL_MIN_CONNECTIONS} per worker"
+        )
+    return max(settings.DB_POOL_MIN_CONNECTIONS, min(share, settings.DB_POOL_MAX_CONNECTIONS))
 
 # Connection pool configuration
-MIN_CONNECTIONS = 1
-MAX_CONNECTIONS = 20
+MIN_CONNECTIONS = settings.DB_POOL_MIN_CONNECTIONS
+MAX_CONNECTIONS = per_worker_max_connections()
 CONNECTION_TIMEOUT = 10
 
-# Create connection pool
-try:
-    connection_pool = pool.SimpleConnectionPool(
-        minconn=MIN_CONNECTIONS,
-        maxconn=MAX_CONNECTIONS,
-        dsn=DATABASE_URL,
-        connect_timeout=CONNECTION_TIMEOUT
-    )
-    logger.info(f"Database connection pool created (min={MIN_CONNECTIONS}, max={MAX_CONNECTIONS})")
-except psycopg2.Error as e:
-    logger.error(f"Failed to create connection pool: {e}")
-    raise
-
-@contextmanager
-def get_db_connection():
-    """Get a database connection from the pool"""
-    conn = None
+def connection_kwargs() -> dict:
+    """psycopg connect() arguments shared by the primary and replica pools"""
+    kwargs = {"row_factory": dict_row, "connect_timeout": CONNECTION_TIMEOUT}
+    if not settings.DB_PREPARED_STATEMENTS:
+        # Otherwise psycopg still prepares any statement run prepare_threshold (5) times
+        kwargs["prepare_threshold"] = None
+    return kwargs
+
+# Async connection pool, opened in the app lifespan (needs a running event loop).
+# Under gunicorn --preload the app is imported in the master, so nothing here may
+# connect at import time: each worker opens its own pool after fork.
+connection_pool: Optional[AsyncConnectionPool] = None
+
+# Seconds of replay lag; 0 when the replica has replayed everything it received
+# (an idle primary sends nothing, so the last replay timestamp alone would look stale)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+class ReadReplica:
+    """A replica's pool plus the lag check that decides whether reads may use it"""
+
+    def __init__(self, conninfo: str):
+        params = conninfo_to_dict(conninfo)
+        # Never log the password: identify replicas by host/port/dbname
+        self.name = f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+        self.pool = AsyncConnectionPool(
+            conninfo=conninfo,
+            min_size=MIN_CONNECTIONS,
+            max_size=MAX_CONNECTIONS,
+            timeout=CONNECTION_TIMEOUT,
+            kwargs=connection_kwargs(),
+            open=False
+        )
+        self.lag: Optional[float] = None
+        self.healthy = False
+
+    async def open(self):
+        try:
+            await self.pool.open(wait=True, timeout=CONNECTION_TIMEOUT)
+        except PoolTimeout as e:
+            # Not fatal: the pool keeps connecting in the background and reads use the primary
+            logger.warning(f"Read replica {self.name} not reachable yet: {e}")
+        await self.check_lag()
+
+    async def check_lag(self):
+        try:
+            async with self.pool.connection(timeout=CONNECTION_TIMEOUT) as conn:
+                row = await (await conn.execute(REPLICA_LAG_QUERY)).fetchone()
+            self.lag = float(row["lag"])
+            healthy = self.lag <= settings.REPLICA_MAX_LAG_SECONDS
+        except (psycopg.Error, PoolTimeout) as e:
+            self.lag = None
+            healthy = False
+            if self.healthy:
+                logger.warning(f"Read replica {self.name} lag check failed: {e}")
+        if healthy != self.healthy:
+            if healthy:
+                logger.info(f"Read replica {self.name} in use (lag {self.lag:.2f}s)")
+            elif self.lag is not None:
+                logger.warning(
+                    f"Read replica {self.name} is {self.lag:.2f}s behind "
+                    f"(max {settings.REPLICA_MAX_LAG_SECONDS}s); reading from the primary"
+                )
+        self.healthy = healthy
+
+    def mark_failed(self, error: Exception):
+        """Stop routing reads here until the next successful lag check"""
+        if self.healthy:
+            logger.warning(f"Read replica {self.name} failed, reading from the primary: {error}")
+        self.healthy = False
+
+    def get_status(self) -> dict:
+        stats = self.pool.get_stats()
+        return {
+            "replica": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": None if self.lag is None else round(self.lag, 3),
+            "open": stats.get("pool_size", 0),
+            "available": stats.get("pool_available", 0),
+            "requests_waiting": stats.get("requests_waiting", 0),
+        }
+
+read_replicas: List[ReadReplica] = []
+_replica_round_robin = itertools.count()
+_lag_monitor: Optional[asyncio.Task] = None
+
+async def _monitor_replica_lag():
+    while True:
+        await asyncio.sleep(settings.REPLICA_LAG_CHECK_INTERVAL)
+        await asyncio.gather(*(replica.check_lag() for replica in read_replicas))
+
+async def _open_read_replicas():
+    global _lag_monitor
+    for conninfo in settings.DATABASE_REPLICA_URLS.split(","):
+        if not conninfo.strip():
+            continue
+        replica = ReadReplica(conninfo.strip())
+        await replica.open()
+        read_replicas.append(replica)
+    if read_replicas:
+        _lag_monitor = asyncio.create_task(_monitor_replica_lag())
+        logger.info(
+            f"{len(read_replicas)} read replica pool(s) created "
+            f"(max lag {settings.REPLICA_MAX_LAG_SECONDS}s)"
+        )
+
+def _pick_replica() -> Optional[ReadReplica]:
+    """Round-robin over the replicas currently within the lag limit"""
+    usable = [replica for replica in read_replicas if replica.healthy]
+    if not usable:
+        return None
+    return usable[next(_replica_round_robin) % len(usable)]
+
+async def init_db_pool():
+    """Open the async connection pool and prewarm MIN_CONNECTIONS (call on startup)"""
+    global connection_pool
+    if connection_pool is not None:
+        return
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is not set!")
     try:
-        conn = connection_pool.getconn()
-        logger.debug("Database connection acquired from pool")
-        yield conn
-        conn.commit()
-        logger.debug("Database transaction committed")
-    except psycopg2.OperationalError as e:
+        connection_pool = AsyncConnectionPool(
+            conninfo=DATABASE_URL,
+            min_size=MIN_CONNECTIONS,
+            max_size=MAX_CONNECTIONS,
+            timeout=CONNECTION_TIMEOUT,
+            kwargs=connection_kwargs(),
+            open=False
+        )
+        # wait=True blocks until MIN_CONNECTIONS are connected, so the first requests don't pay for it
+        await connection_pool.open(wait=True, timeout=CONNECTION_TIMEOUT)
+        logger.info(f"Database connection pool created (min={MIN_CONNECTIONS}, max={MAX_CONNECTIONS})")
+        await _open_read_replicas()
+    except (psycopg.Error, PoolTimeout) as e:
+        if connection_pool is not None:
+            await connection_pool.close()
+        logger.error(f"Failed to create connection pool: {e}")
+        connection_pool = None
+        raise
+
+@asynccontextmanager
+async def get_db_connection(read_only: bool = False):
+    """Get a database connection from the pool (commits on success, rolls back on error)
+
+    read_only=True lets a replica within REPLICA_MAX_LAG_SECONDS serve the
+    query. Keep the default (primary) for writes and for reads that must see a
+    write made moments ago.
+    """
+    if connection_pool is None:
+        raise RuntimeError("Database connection pool is not initialized")
+    replica = _pick_replica() if read_only else None
+    if read_only and read_replicas:
+        DB_READ_ROUTING.labels("replica" if replica else "primary_fallback").inc()
+    pool = replica.pool if replica else connection_pool
+    start = time.perf_counter()
+    try:
+        async with pool.connection() as conn:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+            logger.debug("Database connection acquired from pool")
+            yield conn
+        logger.debug("Database connection returned to pool")
+    except psycopg.OperationalError as e:
+        if replica is not None:
+            replica.mark_failed(e)
         logger.error(f"Database operational error: {e}")
-        if conn:
-            conn.rollback()
         raise
-    except psycopg2.Error as e:
+    except psycopg.Error as e:
         logger.error(f"Database error: {e}")
-        if conn:
-            conn.rollback()
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            connection_pool.putconn(conn)
-            logger.debug("Database connection returned to pool")
 
 def get_db_cursor(conn):
     """Get a cursor that returns results as dictionaries"""
-    return conn.cursor(cursor_factory=RealDictCursor)
+    return conn.cursor(row_factory=dict_row)
 
-def close_all_connections():
+async def close_all_connections():
     """Close all connections in the pool (call on shutdown)"""
+    global connection_pool, _lag_monitor
+    if _lag_monitor is not None:
+        _lag_monitor.cancel()
+        try:
+            await _lag_monitor
+        except asyncio.CancelledError:
+            pass
+        _lag_monitor = None
+    while read_replicas:
+        await read_replicas.pop().pool.close()
     if connection_pool:
-        connection_pool.closeall()
+        await connection_pool.close()
+        connection_pool = None
         logger.info("All database connections closed")
 
+async def check_db_connection(timeout: float) -> bool:
+    """Run a trivial query through the pool; used by the readiness probe"""
+    if connection_pool is None:
+        return False
+    try:
+        async with connection_pool.connection(timeout=timeout) as conn:
+            await conn.execute("SELECT 1")
+        return True
+    except (psycopg.Error, PoolTimeout) as e:
+        logger.warning(f"Database readiness check failed: {e}")
+        return False
+
 def get_pool_status() -> dict:
     """Get current connection pool status for monitoring"""
     try:
-        # Access internal pool to get stats
-        available = connection_pool._pool.qsize() if hasattr(connection_pool, '_pool') else 0
-        in_use = MAX_CONNECTIONS - available
+        if connection_pool is None:
+            return {"error": "Connection pool is not initialized"}
+        stats = connection_pool.get_stats()
+        opened = stats.get("pool_size", 0)
+        available = stats.get("pool_available", 0)
+        in_use = opened - available
         return {
             "max_connections": MAX_CONNECTIONS,
             "min_connections": MIN_CONNECTIONS,
+            "open": opened,
             "available": available,
             "in_use": in_use,
+            "requests_waiting": stats.get("requests_waiting", 0),
             "utilization_percent": round((in_use / MAX_CONNECTIONS) * 100, 2)
         }
     except Exception as e:
         logger.error(f"Error getting pool status: {e}")
         return {"error": "Unable to retrieve pool status"}
+
+def get_replica_status() -> list:
+    """Per-replica lag and pool status for monitoring (empty without replicas)"""
+    return [replica.get_status() for replica in read_replicas]
@@ -0,0 +1,251 @@
+"""
+Write-behind writer for activity_log and credit_transactions
+Events are buffered in memory and written with COPY in batches, when a batch
+fills up or every flush interval, instead of one INSERT per request. Producers
+wait (up to a timeout) while the buffer is full. On shutdown the buffer is
+flushed; whatever cannot be written is spilled to disk and replayed on the
+next start
+"""
+import os
+import json
+import glob
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import psycopg
+
+from config import settings
+from database import get_db_connection
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ACTIVITY_LOG = "activity_log"
+CREDIT_TRANSACTIONS = "credit_transactions"
+
+# Columns written per table, in COPY order
+TABLE_COLUMNS = {
+    ACTIVITY_LOG: ("user_id", "activity_type", "description", "metadata", "created_at"),
+    CREDIT_TRANSACTIONS: ("user_id", "amount", "transaction_type", "description", "created_at"),
+}
+
+class EventWriterBusy(Exception):
+    """Raised when the buffer stayed full for the whole enqueue timeout"""
+
+class EventWriter:
+    """Buffers rows per table and writes them in batches from one background task"""
+
+    def __init__(self, batch_size: int, flush_interval: float, max_buffer: int,
+                 enqueue_timeout: float, spill_dir: str):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_dir = spill_dir
+        self._buffers: Dict[str, List[tuple]] = {table: [] for table in TABLE_COLUMNS}
+        self._pending = 0
+        self._space = asyncio.Condition()
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.blocked = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.invalid = 0
+
+    async def start(self):
+        """Replay spilled events and start the flush loop (call on startup)"""
+        if self._task is not None:
+            return
+        self._replay_spill_files()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Event writer started (batch={self.batch_size}, interval={self.flush_interval}s, "
+            f"buffer={self.max_buffer})"
+        )
+
+    async def stop(self):
+        """Stop the flush loop and write out everything buffered (call on shutdown)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(3):
+            if not self._pending:
+                break
+            await self.flush()
+            if self._pending:
+                await asyncio.sleep(0.5 * (attempt + 1))
+        if self._pending:
+            self._spill()
+        logger.info(f"Event writer stopped ({self.written} events written)")
+
+    async def record(self, table: str, row: tuple):
+        """Buffer one row, waiting while the buffer is full (backpressure)"""
+        if self._pending >= self.max_buffer:
+            self.blocked += 1
+            self._flush_requested.set()
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: self._pending < self.max_buffer),
+                        timeout=self.enqueue_timeout,
+                    )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise EventWriterBusy()
+        self._buffers[table].append(row)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self._flush_requested.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every buffered row; on failure the rows go back to the front of the buffer"""
+        async with self._flush_lock:
+            for table, columns in TABLE_COLUMNS.items():
+                rows = self._buffers[table]
+                if not rows:
+                    continue
+                self._buffers[table] = []
+                written = len(rows)
+                try:
+                    async with get_db_connection() as conn:
+                        async with conn.cursor() as cursor:
+                            async with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                                for row in rows:
+                                    await copy.write_row(row)
+                except (psycopg.IntegrityError, psycopg.DataError) as e:
+                    # A bad row (e.g. a deleted user) must not block the rest of the batch
+                    logger.warning(f"Event writer batch of {table} rejected ({e}), writing rows one by one")
+                    try:
+                        written = await self._write_individually(table, rows)
+                    except (psycopg.OperationalError, RuntimeError) as e:
+                        self.failed_flushes += 1
+                        self._buffers[table] = rows + self._buffers[table]
+                        logger.error(f"Event writer flush of {len(rows)} {table} rows failed: {e}")
+                        continue
+                except (psycopg.Error, RuntimeError) as e:
+                    self.failed_flushes += 1
+                    self._buffers[table] = rows + self._buffers[table]
+                    logger.error(f"Event writer flush of {len(rows)} {table} rows failed: {e}")
+                    continue
+                self._pending -= len(rows)
+                self.written += written
+                self.flushes += 1
+            async with self._space:
+                self._space.notify_all()
+
+    async def _write_individually(self, table: str, rows: List[tuple]) -> int:
+        """Insert rows one per savepoint, dropping (and logging) the ones Postgres rejects"""
+        query = _insert_query(table)
+        written = 0
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                for row in rows:
+                    try:
+                        async with conn.transaction():
+                            await cursor.execute(query, row)
+                        written += 1
+                    except (psycopg.IntegrityError, psycopg.DataError) as e:
+                        self.invalid += 1
+                        logger.error(f"Dropped invalid {table} event {row!r}: {e}")
+        return written
+
+    def _spill_path(self) -> str:
+        return os.path.join(self.spill_dir, f"events-{os.getpid()}.jsonl")
+
+    def _spill(self):
+        """Last resort on shutdown: persist unwritten rows for the next start to replay"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self._spill_path()
+        with open(path, "a") as f:
+            for table, rows in self._buffers.items():
+                for row in rows:
+                    f.write(json.dumps({"table": table, "row": row}, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.spilled += self._pending
+        logger.error(f"Event writer spilled {self._pending} unwritten events to {path}")
+        self._buffers = {table: [] for table in TABLE_COLUMNS}
+        self._pending = 0
+
+    def _replay_spill_files(self):
+        """Load events spilled by earlier processes; each file is claimed by exactly one worker"""
+        for path in glob.glob(os.path.join(self.spill_dir, "events-*.jsonl")):
+            claimed = f"{path}.replaying-{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue  # another worker claimed it
+            with open(claimed) as f:
+                for line in f:
+                    event = json.loads(line)
+                    self._buffers[event["table"]].append(tuple(event["row"]))
+                    self._pending += 1
+            os.remove(claimed)
+            logger.info(f"Replaying spilled events from {path}")
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": settings.EVENT_WRITER_ENABLED,
+            "buffered": self._pending,
+            "max_buffer": self.max_buffer,
+            "written_total": self.written,
+            "flushes_total": self.flushes,
+            "failed_flushes_total": self.failed_flushes,
+            "blocked_total": self.blocked,
+            "rejected_total": self.rejected,
+            "spilled_total": self.spilled,
+            "invalid_total": self.invalid,
+        }
+
+event_writer = EventWriter(
+    batch_size=settings.EVENT_WRITER_BATCH_SIZE,
+    flush_interval=settings.EVENT_WRITER_FLUSH_INTERVAL,
+    max_buffer=settings.EVENT_WRITER_MAX_BUFFER,
+    enqueue_timeout=settings.EVENT_WRITER_ENQUEUE_TIMEOUT,
+    spill_dir=settings.EVENT_WRITER_SPILL_DIR,
+)
+
+def _insert_query(table: str) -> str:
+    columns = TABLE_COLUMNS[table]
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+async def _write_now(table: str, row: tuple):
+    """Unbuffered single-row INSERT, used when the writer is disabled"""
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(_insert_query(table), row)
+
+async def _record(table: str, row: tuple):
+    if settings.EVENT_WRITER_ENABLED:
+        await event_writer.record(table, row)
+    else:
+        await _write_now(table, row)
+
+async def log_activity(user_id: int, activity_type: str, description: Optional[str] = None,
+                       metadata: Optional[dict] = None):
+    """Record a user activity; never fails the calling request"""
+    row = (user_id, activity_type, description,
+           json.dumps(metadata) if metadata is not None else None, datetime.now(timezone.utc))
+    try:
+        await _record(ACTIVITY_LOG, row)
+    except (EventWriterBusy, psycopg.Error, RuntimeError) as e:
+        logger.warning(f"Dropped {activity_type} activity for user {user_id}: {e!r}")
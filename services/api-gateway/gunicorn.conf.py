@@ -0,0 +1,57 @@
+"""
+Gunicorn configuration for the API Gateway (production process model)
+
+Runs one uvicorn worker per available CPU with the app preloaded in the
+master, so workers fork with the code already imported. Everything that owns
+a socket, thread or event loop (DB pool, upstream clients, Redis, hashing
+pool) is created in the app lifespan, i.e. in each worker after fork.
+
+On SIGTERM workers stop accepting, finish in-flight requests for up to
+GATEWAY_GRACEFUL_TIMEOUT seconds, then run the lifespan shutdown.
+
+Usage (from services/api-gateway):
+    gunicorn -c gunicorn.conf.py main:app
+"""
+import os
+import math
+import shutil
+
+def _available_cpus() -> int:
+    """CPUs this container may use: the cgroup quota if one is set, else the affinity mask"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
+workers = int(os.getenv("GATEWAY_WORKERS", "0")) or _available_cpus()
+# config.Settings reads this to give each worker its share of DB_CONNECTION_BUDGET
+os.environ["GATEWAY_WORKERS"] = str(workers)
+
+# Prometheus multiprocess mode must be on before the preloaded app imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("GATEWAY_BIND", "0.0.0.0:8000")
+preload_app = True
+graceful_timeout = int(os.getenv("GATEWAY_GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("GATEWAY_WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("GATEWAY_KEEPALIVE", "5"))
+# Recycle workers now and then to bound slow leaks; jitter avoids restarting them together
+max_requests = int(os.getenv("GATEWAY_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+accesslog = None
+
+def on_starting(server):
+    """Start each run with an empty metrics directory (files from dead PIDs would be summed)"""
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+def child_exit(server, worker):
+    """Drop an exited worker's live gauges from the multiprocess aggregate"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,94 @@
+"""
+Bounded worker pool for password hashing
+Runs bcrypt off the event loop and rejects work fast when the queue is full
+"""
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from config import settings
+from metrics import PASSWORD_HASH_LATENCY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+class PasswordHasher:
+    """Executor wrapper with a bounded queue and latency counters"""
+
+    def __init__(self, max_workers: int, max_queue: int, use_processes: bool = False):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+
+    def start(self):
+        """Create the worker pool (call on startup)"""
+        if self._executor is not None:
+            return
+        if self.use_processes:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            # bcrypt releases the GIL, so threads give real parallelism
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        logger.info(
+            f"Password hasher started (workers={self.max_workers}, queue={self.max_queue}, "
+            f"processes={self.use_processes})"
+        )
+
+    async def shutdown(self):
+        """Stop the worker pool, waiting for queued hashes (call on shutdown)"""
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Waiting for in-flight bcrypt calls must not block the event loop
+            await asyncio.to_thread(executor.shutdown, wait=True)
+            logger.info("Password hasher stopped")
+
+    async def run(self, fn: Callable, *args):
+        """Run a hashing function in the pool, or raise PasswordHasherBusy"""
+        if self._pending >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            raise PasswordHasherBusy()
+        if self._executor is None:
+            self.start()
+
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._pending -= 1
+            self._completed += 1
+            self._total_seconds += elapsed
+            self._max_seconds = max(self._max_seconds, elapsed)
+            PASSWORD_HASH_LATENCY.labels(fn.__name__).observe(elapsed)
+
+    def get_status(self) -> dict:
+        """Queue depth and latency statistics for monitoring"""
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self._pending, self.max_workers),
+            "queue_depth": max(0, self._pending - self.max_workers),
+            "completed_total": self._completed,
+            "rejected_total": self._rejected,
+            "avg_latency_ms": round(self._total_seconds / self._completed * 1000, 2) if self._completed else 0.0,
+            "max_latency_ms": round(self._max_seconds * 1000, 2),
+        }
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+    use_processes=settings.PASSWORD_HASH_USE_PROCESSES,
+)
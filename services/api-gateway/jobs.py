@@ -0,0 +1,309 @@
+"""
+Asynchronous analysis job queue for the API Gateway
+Analyze routes enqueue a job and return 202; a worker pool consumes jobs,
+runs the upstream analysis and records the outcome in analysis_jobs
+"""
+import json
+import uuid
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import psycopg
+from fastapi import HTTPException, status
+
+from analysis import analyze_submission, submission_text
+from config import settings
+from credits import reserve_credits, refund_credits
+from database import get_db_connection
+from event_writer import log_activity
+from queries import register, fetchone
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+SUBMISSION_DATA = register("submission_data", "SELECT data FROM submissions WHERE id = %s")
+OWNED_JOB = register("owned_job", """
+    SELECT id, submission_id, analysis_type, status, score, error, created_at, updated_at
+    FROM analysis_jobs
+    WHERE id = %s AND user_id = %s
+""")
+
+class InMemoryJobQueue:
+    """Process-local queue, for development and tests without a broker"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: Dict[asyncio.Task, dict] = {}
+        self._stopping = False
+
+    async def start(self, handler: JobHandler):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work(handler)))
+        logger.info(f"In-memory job queue started with {self.workers} workers")
+
+    async def _work(self, handler: JobHandler):
+        task = asyncio.current_task()
+        while True:
+            job = await self._queue.get()
+            self._in_flight[task] = job
+            try:
+                await handler(job)
+            except Exception as e:
+                # A failing job must not take its worker down with it
+                logger.error(f"Job worker: unhandled error in job {job.get('job_id')}: {e}")
+            finally:
+                self._in_flight.pop(task, None)
+                self._queue.task_done()
+
+    async def publish(self, job: dict):
+        if self._stopping:
+            raise RuntimeError("Job queue is shutting down")
+        await self._queue.put(job)
+
+    async def stop(self, grace: float) -> List[dict]:
+        """Let the workers drain the queue for up to `grace` seconds; returns the jobs left undone"""
+        self._stopping = True
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=grace)
+            except asyncio.TimeoutError:
+                pass
+        abandoned = list(self._in_flight.values())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        while not self._queue.empty():
+            abandoned.append(self._queue.get_nowait())
+            self._queue.task_done()
+        return abandoned
+
+    def get_status(self) -> dict:
+        return {
+            "backend": "memory", "workers": self.workers,
+            "queued": self._queue.qsize(), "running": len(self._in_flight),
+        }
+
+class RabbitMQJobQueue:
+    """Durable queue on RabbitMQ (Settings.RABBITMQ_URL)"""
+
+    def __init__(self, url: str, queue_name: str, workers: int):
+        self.url = url
+        self.queue_name = queue_name
+        self.workers = workers
+        self._connection = None
+        self._channel = None
+        self._queue = None
+        self._consumer_tag: Optional[str] = None
+        # aio-pika runs each delivery in its own task
+        self._in_flight: Dict[asyncio.Task, dict] = {}
+
+    async def start(self, handler: JobHandler):
+        # Imported here so the in-memory backend works without aio-pika installed
+        import aio_pika
+
+        self._connection = await aio_pika.connect_robust(self.url)
+        self._channel = await self._connection.channel()
+        self._queue = await self._channel.declare_queue(self.queue_name, durable=True)
+        if self.workers > 0:
+            # Prefetch bounds how many jobs this gateway process runs at once
+            await self._channel.set_qos(prefetch_count=self.workers)
+
+            async def on_message(message):
+                async with message.process(requeue=False):
+                    job = json.loads(message.body)
+                    task = asyncio.current_task()
+                    self._in_flight[task] = job
+                    try:
+                        await handler(job)
+                    finally:
+                        self._in_flight.pop(task, None)
+
+            self._consumer_tag = await self._queue.consume(on_message)
+        logger.info(f"RabbitMQ job queue '{self.queue_name}' started with {self.workers} workers")
+
+    async def publish(self, job: dict):
+        import aio_pika
+
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                body=json.dumps(job).encode('utf-8'),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=self.queue_name
+        )
+
+    async def stop(self, grace: float) -> List[dict]:
+        """Stop consuming, give in-flight jobs up to `grace` seconds; returns the jobs left undone
+
+        Messages not yet delivered stay on the broker for the next consumer.
+        """
+        abandoned = []
+        if self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+            self._consumer_tag = None
+        if self._in_flight:
+            _, pending = await asyncio.wait(list(self._in_flight), timeout=grace)
+            abandoned = [self._in_flight[task] for task in pending if task in self._in_flight]
+            for task in pending:
+                # Rejects the message without requeueing: the job is failed and refunded instead
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._connection:
+            await self._connection.close()
+            self._connection = None
+        return abandoned
+
+    def get_status(self) -> dict:
+        return {
+            "backend": "rabbitmq", "workers": self.workers,
+            "queue": self.queue_name, "running": len(self._in_flight),
+        }
+
+def _create_queue():
+    if settings.JOB_QUEUE_BACKEND == "rabbitmq":
+        return RabbitMQJobQueue(settings.RABBITMQ_URL, settings.JOB_QUEUE_NAME, settings.JOB_WORKERS)
+    return InMemoryJobQueue(settings.JOB_WORKERS)
+
+job_queue = _create_queue()
+
+async def _set_job_status(job_id: str, job_status: str, score: Optional[int] = None,
+                          error: Optional[str] = None, unfinished_only: bool = False) -> bool:
+    """Update the job row; returns False if unfinished_only and it already finished"""
+    query = """
+        UPDATE analysis_jobs
+        SET status = %s, score = %s, error = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """
+    if unfinished_only:
+        query += " AND status IN ('queued', 'running')"
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, (job_status, score, error, job_id))
+            return cursor.rowcount > 0
+
+async def _refund_job(job: dict):
+    """Return the credits reserved for a job that did not complete"""
+    if job.get("user_id") is not None and job.get("credits"):
+        await refund_credits(job["user_id"], job["credits"], f"Refund for failed job {job['job_id']}")
+
+async def _fail_job(job: dict, error: str, unfinished_only: bool = False):
+    """Mark the job failed (best effort: the database may be what failed) and refund it
+
+    With unfinished_only, a job that already completed is left alone and not refunded.
+    """
+    try:
+        if not await _set_job_status(job["job_id"], "failed", error=error, unfinished_only=unfinished_only):
+            return
+    except Exception as e:
+        logger.error(f"Job {job['job_id']}: could not record failure ({error}): {e}")
+    await _refund_job(job)
+
+async def process_job(job: dict):
+    """Worker entry point: run one analysis job and record the outcome"""
+    job_id = job["job_id"]
+    try:
+        await _set_job_status(job_id, "running")
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                submission = await fetchone(cursor, SUBMISSION_DATA, (job["submission_id"],))
+        if submission is None:
+            await _fail_job(job, "Submission not found")
+            return
+        score = await analyze_submission(job["analysis"], job["submission_id"], submission_text(submission["data"]))
+        await _set_job_status(job_id, "completed", score=score)
+        if job.get("user_id") is not None:
+            await log_activity(
+                job["user_id"], "analysis", f"{job['analysis']} analysis of submission {job['submission_id']}",
+                {"job_id": job_id, "submission_id": job["submission_id"], "score": score}
+            )
+    except httpx.HTTPStatusError as e:
+        await _fail_job(job, f"Analysis service returned {e.response.status_code}")
+    except httpx.RequestError as e:
+        logger.error(f"Job {job_id}: analysis service unavailable: {e}")
+        await _fail_job(job, "Analysis service unavailable")
+    except psycopg.Error as e:
+        logger.error(f"Job {job_id}: database error: {e}")
+        await _fail_job(job, "Database error")
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        await _fail_job(job, "Internal error")
+
+async def start_job_queue():
+    """Connect the queue backend and start workers (call on startup)"""
+    await job_queue.start(process_job)
+
+async def stop_job_queue():
+    """Stop workers and disconnect (call on shutdown)
+
+    Workers get JOB_SHUTDOWN_GRACE_SECONDS to finish; jobs still queued or
+    running after that are marked failed and their credits refunded, so no
+    reservation outlives the process.
+    """
+    abandoned = await job_queue.stop(settings.JOB_SHUTDOWN_GRACE_SECONDS)
+    for job in abandoned:
+        await _fail_job(job, "Interrupted by gateway shutdown; please resubmit", unfinished_only=True)
+    if abandoned:
+        logger.warning(f"Failed and refunded {len(abandoned)} unfinished jobs at shutdown")
+
+async def enqueue_analysis(analysis: str, submission_id: int, user_id: int) -> dict:
+    """Reserve credits, record a queued job and hand it to the workers
+
+    Raises InsufficientCredits (402) before anything is queued if the account
+    cannot cover the analysis; the reservation is refunded if the job fails.
+    """
+    job_id = str(uuid.uuid4())
+    cost = settings.ANALYSIS_CREDIT_COST
+    await reserve_credits(user_id, cost, f"{analysis} analysis of submission {submission_id} (job {job_id})")
+    job = {
+        "job_id": job_id, "analysis": analysis, "submission_id": submission_id,
+        "user_id": user_id, "credits": cost if settings.CREDIT_METERING_ENABLED else 0,
+    }
+    try:
+        async with get_db_connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    """
+                    INSERT INTO analysis_jobs (id, user_id, submission_id, analysis_type, status)
+                    VALUES (%s, %s, %s, %s, 'queued')
+                    """,
+                    (job_id, user_id, submission_id, analysis)
+                )
+    except psycopg.Error:
+        await _refund_job(job)
+        raise
+    try:
+        await job_queue.publish(job)
+    except Exception as e:
+        logger.error(f"Failed to publish job {job_id}: {e}")
+        await _fail_job(job, "Job queue unavailable")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Job queue unavailable"
+        )
+    logger.info(f"Queued {analysis} job {job_id} for submission {submission_id}")
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}"
+    }
+
+async def get_job(job_id: str, user_id: int) -> dict:
+    """Job status for its owner"""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    async with get_db_connection() as conn:
+        async with conn.cursor() as cursor:
+            job = await fetchone(cursor, OWNED_JOB, (job_id, user_id))
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
@@ -2,12 +2,10 @@
 SmartScreen AI - API Gateway
 Main entry point for all API requests
 """
-from fastapi import FastAPI, Request, Depends, HTTPException, status
+from fastapi import FastAPI, Request, Depends, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 import httpx
 import os
 from contextlib import asynccontextmanager
@@ -15,22 +13,66 @@ import logging
 from typing import Optional
 
 from config import settings
-from auth import get_current_user, create_access_token
-from models import User, LoginRequest, RegisterRequest
+from auth import (
+    get_current_user, create_access_token, token_cache,
+    register_user, authenticate_user, load_signing_key, get_user_credits,
+)
+from database import init_db_pool, close_all_connections, get_pool_status, get_replica_status
+from hashing import password_hasher
+from user_cache import user_cache
+from models import User, LoginRequest, RegisterRequest, BulkAnalysisRequest
+from bulk_analysis import start_bulk_analysis, get_run, cancel_all_runs
+from rankings import rankings_cache, fetch_rankings, etag_matches
+from rate_limit import limiter, get_remote_address
+from metrics import MetricsMiddleware, register_state_collector, start_metrics, stop_metrics, render_metrics
+from event_writer import event_writer, log_activity
+from readiness import start_readiness, stop_accepting, stop_readiness, check_readiness
+from jobs import enqueue_analysis, get_job, start_job_queue, stop_job_queue, job_queue
+from submissions import (
+    decode_cursor, ensure_form_owner, fetch_submissions_page, stream_submissions,
+    get_owned_submission,
+    get_submission_detail as aggregate_submission_detail,
+)
+from upstream import (
+    FORMS,
+    init_upstream_clients, close_upstream_clients,
+    proxy_upstream, get_upstream_pool_status, get_upstream_breaker_status,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     logger.info("🚀 API Gateway starting up...")
+    load_signing_key()
+    await init_db_pool()
+    await init_upstream_clients()
+    password_hasher.start()
+    await user_cache.start()
+    await start_job_queue()
+    await rankings_cache.start()
+    await limiter.start()
+    await event_writer.start()
+    start_metrics()
+    await start_readiness()
     yield
     logger.info("👋 API Gateway shutting down...")
+    stop_accepting()
+    await cancel_all_runs()
+    await stop_job_queue()
+    await rankings_cache.stop()
+    await limiter.stop()
+    await close_upstream_clients()
+    # After everything that records events has stopped, before the pool closes
+    await event_writer.stop()
+    await close_all_connections()
+    await password_hasher.shutdown()
+    await user_cache.stop()
+    await stop_readiness()
+    await stop_metrics()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -42,9 +84,12 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# Add rate limiting
+# Rate limiting (see rate_limit.py); keyed per user when authenticated, else per IP
 app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+# Prometheus metrics: per-route latency, plus pool gauges read at scrape time
+app.add_middleware(MetricsMiddleware)
+register_state_collector(get_pool_status, password_hasher.get_status)
 
 # CORS middleware - environment-based origins
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
@@ -61,18 +106,37 @@ app.add_middleware(
 @app.get("/health")
 async def health_check():
     """Health check endpoint for load balancers"""
-    from database import get_pool_status
     return {
         "status": "healthy",
         "service": "api-gateway",
-        "database_pool": get_pool_status()
+        "database_pool": get_pool_status(),
+        "database_replicas": get_replica_status(),
+        "upstream_pools": get_upstream_pool_status(),
+        "upstream_breakers": get_upstream_breaker_status(),
+        "password_hashing": password_hasher.get_status(),
+        "user_cache": user_cache.get_stats(),
+        "token_cache": token_cache.get_stats(),
+        "job_queue": job_queue.get_status(),
+        "rankings_cache": rankings_cache.get_stats(),
+        "rate_limiter": limiter.get_stats(),
+        "event_writer": event_writer.get_stats()
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/ready")
 async def readiness_check():
-    """Readiness check for Kubernetes"""
-    # TODO: Check database connection, Redis, etc.
-    return {"status": "ready"}
+    """Readiness check for Kubernetes: 503 until warm-up is done or while a dependency is down"""
+    ready, checks = await check_readiness()
+    if not ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "not_ready", "checks": checks}
+        )
+    return {"status": "ready", "checks": checks}
 
 @app.get("/")
 async def root():
@@ -90,11 +154,9 @@ async def root():
 @limiter.limit("5/minute")
 async def register(request: Request, data: RegisterRequest):
     """Register a new user"""
-    from auth import register_user
-    
     try:
         logger.info(f"Registration attempt for email: {data.email}")
-        user = register_user(
+        user = await register_user(
             email=data.email,
             password=data.password,
             full_name=data.full_name,
@@ -105,6 +167,7 @@ async def register(request: Request, data: RegisterRequest):
             organization_size=data.organization_size
         )
         access_token = create_access_token({"sub": data.email})
+        await log_activity(user["id"], "register", "Account created")
         
         return {
             "access_token": access_token,
@@ -124,11 +187,9 @@ async def register(request: Request, data: RegisterRequest):
 @limiter.limit("10/minute")
 async def login(request: Request, data: LoginRequest):
     """Login and get JWT token"""
-    from auth import authenticate_user
-    
     logger.info(f"Login attempt for email: {data.email}")
     
-    user = authenticate_user(data.email, data.password)
+    user = await authenticate_user(data.email, data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,6 +197,7 @@ async def login(request: Request, data: LoginRequest):
         )
     
     access_token = create_access_token({"sub": data.email})
+    await log_activity(user["id"], "login", "Logged in", {"ip": get_remote_address(request)})
     
     return {
         "access_token": access_token,
@@ -146,7 +208,7 @@ async def login(request: Request, data: LoginRequest):
 @limiter.limit("100/minute")
 async def get_current_user_info(request: Request, current_user: User = Depends(get_current_user)):
     """Get current user information"""
-    return current_user
+    return {**current_user, "credits": await get_user_credits(current_user["id"])}
 
 # ==================== Forms Service Proxy ====================
 
@@ -154,166 +216,214 @@ async def get_current_user_info(request: Request, current_user: User = Depends(g
 @limiter.limit("10/minute")
 async def connect_google_form(
     request: Request,
-    current_user: User = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user)
 ):
     """Connect a Google Form"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.FORMS_SERVICE_URL}/connect/google",
-                json=await request.json(),
-                headers={"X-User-ID": str(current_user.id)},
-                timeout=30.0
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error connecting to forms service: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Forms service unavailable"
-            )
+    try:
+        return await proxy_upstream(
+            FORMS, request, "/connect/google",
+            headers={"X-User-ID": str(current_user["id"])}
+        )
+    except httpx.RequestError as e:
+        logger.error(f"Error connecting to forms service: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Forms service unavailable"
+        )
 
 @app.post("/api/forms/connect/microsoft")
 @limiter.limit("10/minute")
 async def connect_microsoft_form(
     request: Request,
-    current_user: User = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user)
 ):
     """Connect a Microsoft Form"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.FORMS_SERVICE_URL}/connect/microsoft",
-                json=await request.json(),
-                headers={"X-User-ID": str(current_user.id)},
-                timeout=30.0
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error connecting to forms service: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Forms service unavailable"
-            )
+    try:
+        return await proxy_upstream(
+            FORMS, request, "/connect/microsoft",
+            headers={"X-User-ID": str(current_user["id"])}
+        )
+    except httpx.RequestError as e:
+        logger.error(f"Error connecting to forms service: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Forms service unavailable"
+        )
 
 @app.get("/api/forms")
-async def list_connected_forms(current_user: User = Depends(get_current_user)):
+async def list_connected_forms(request: Request, current_user: dict = Depends(get_current_user)):
     """List all connected forms for the current user"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{settings.FORMS_SERVICE_URL}/forms",
-                headers={"X-User-ID": str(current_user.id)},
-                timeout=30.0
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error fetching forms: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Forms service unavailable"
-            )
+    try:
+        return await proxy_upstream(
+            FORMS, request, "/forms",
+            headers={"X-User-ID": str(current_user["id"])}
+        )
+    except httpx.RequestError as e:
+        logger.error(f"Error fetching forms: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Forms service unavailable"
+        )
 
 # ==================== Submissions ====================
 
 @app.get("/api/forms/{form_id}/submissions")
 async def get_submissions(
-    form_id: str,
-    current_user: User = Depends(get_current_user)
+    form_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
 ):
-    """Get all submissions for a form"""
-    # TODO: Fetch from database
-    return {
-        "form_id": form_id,
-        "submissions": []
-    }
+    """Get submissions for a form, newest first
+
+    Pages are keyset-paginated: pass the returned `next_cursor` back as `cursor`.
+    With `format=ndjson` every submission after the cursor is streamed instead.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    await ensure_form_owner(form_id, current_user["id"])
+    
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_submissions(form_id, after),
+            media_type="application/x-ndjson"
+        )
+    return await fetch_submissions_page(form_id, limit, after)
 
 @app.get("/api/submissions/{submission_id}")
 async def get_submission_detail(
-    submission_id: str,
-    current_user: User = Depends(get_current_user)
+    submission_id: int,
+    current_user: dict = Depends(get_current_user)
 ):
     """Get detailed submission with plagiarism and AI detection results"""
-    # TODO: Aggregate data from multiple services
-    return {
-        "submission_id": submission_id,
-        "plagiarism_score": 0.0,
-        "ai_score": 0.0,
-        "quality_score": 0.0
-    }
+    return await aggregate_submission_detail(submission_id, current_user["id"])
 
 # ==================== Plagiarism Detection ====================
 
-@app.post("/api/submissions/{submission_id}/analyze/plagiarism")
+@app.post("/api/submissions/{submission_id}/analyze/plagiarism", status_code=status.HTTP_202_ACCEPTED)
 @limiter.limit("20/minute")
 async def analyze_plagiarism(
     request: Request,
-    submission_id: str,
-    current_user: User = Depends(get_current_user)
+    submission_id: int,
+    current_user: dict = Depends(get_current_user)
 ):
-    """Trigger plagiarism analysis for a submission"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.PLAGIARISM_SERVICE_URL}/analyze",
-                json={"submission_id": submission_id},
-                timeout=60.0
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling plagiarism service: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Plagiarism service unavailable"
-            )
+    """Queue plagiarism analysis for a submission; poll the returned job for the result"""
+    await get_owned_submission(submission_id, current_user["id"])
+    return await enqueue_analysis("plagiarism", submission_id, current_user["id"])
 
 # ==================== AI Detection ====================
 
-@app.post("/api/submissions/{submission_id}/analyze/ai")
+@app.post("/api/submissions/{submission_id}/analyze/ai", status_code=status.HTTP_202_ACCEPTED)
 @limiter.limit("20/minute")
 async def analyze_ai_content(
     request: Request,
-    submission_id: str,
-    current_user: User = Depends(get_current_user)
+    submission_id: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue AI content detection for a submission; poll the returned job for the result"""
+    await get_owned_submission(submission_id, current_user["id"])
+    return await enqueue_analysis("ai", submission_id, current_user["id"])
+
+# ==================== Analysis Jobs ====================
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the status (and score, once completed) of an analysis job"""
+    return await get_job(job_id, current_user["id"])
+
+# ==================== Bulk Analysis ====================
+
+@app.post("/api/forms/{form_id}/analyze", status_code=status.HTTP_202_ACCEPTED)
+@limiter.limit("5/minute")
+async def analyze_form(
+    request: Request,
+    form_id: int,
+    data: BulkAnalysisRequest,
+    current_user: dict = Depends(get_current_user)
 ):
-    """Trigger AI content detection for a submission"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{settings.AI_DETECTION_SERVICE_URL}/analyze",
-                json={"submission_id": submission_id},
-                timeout=60.0
+    """Run the chosen analyses over every submission of a form
+
+    Work proceeds in chunks under a concurrency cap; poll the returned run for
+    progress. A failed run can be resumed from its checkpoint with `resume_run_id`.
+    """
+    await ensure_form_owner(form_id, current_user["id"])
+    
+    start_after_id = data.after_submission_id or 0
+    if data.resume_run_id:
+        previous = await get_run(data.resume_run_id, form_id, current_user["id"])
+        if previous is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Bulk analysis run not found"
             )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling AI detection service: {e}")
+        if previous.status in ("pending", "running"):
             raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="AI detection service unavailable"
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Bulk analysis run is still in progress"
             )
+        start_after_id = previous.checkpoint_submission_id
+    
+    run = await start_bulk_analysis(
+        form_id=form_id,
+        user_id=current_user["id"],
+        analyses=list(dict.fromkeys(data.analyses)),
+        chunk_size=data.chunk_size or settings.BULK_ANALYSIS_CHUNK_SIZE,
+        concurrency=min(data.concurrency or settings.BULK_ANALYSIS_CONCURRENCY,
+                        settings.BULK_ANALYSIS_MAX_CONCURRENCY),
+        only_missing=data.only_missing,
+        start_after_id=start_after_id
+    )
+    return run.to_dict()
+
+@app.get("/api/forms/{form_id}/analyze/{run_id}")
+async def get_form_analysis_progress(
+    form_id: int,
+    run_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get progress and throughput of a bulk analysis run"""
+    run = await get_run(run_id, form_id, current_user["id"])
+    if run is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Bulk analysis run not found"
+        )
+    return run.to_dict()
 
 # ==================== Rankings ====================
 
 @app.get("/api/forms/{form_id}/rankings")
 async def get_rankings(
-    form_id: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    form_id: int,
+    current_user: dict = Depends(get_current_user)
 ):
-    """Get ranked submissions for a form"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{settings.RANKING_SERVICE_URL}/rankings/{form_id}",
-                headers={"X-User-ID": str(current_user.id)},
-                timeout=30.0
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Error calling ranking service: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Ranking service unavailable"
+    """Get ranked submissions for a form
+
+    Served from the rankings cache with a strong ETag; `If-None-Match` gets a 304.
+    Stale entries are returned immediately while a background refresh runs.
+    """
+    await ensure_form_owner(form_id, current_user["id"])
+    
+    entry = await rankings_cache.get(form_id) if settings.RANKINGS_CACHE_ENABLED else None
+    if entry is None:
+        response, entry = await fetch_rankings(form_id, current_user["id"])
+        if entry is None:
+            return Response(
+                content=response.content, status_code=response.status_code,
+                media_type=response.headers.get("content-type")
             )
+    elif entry.is_stale():
+        rankings_cache.schedule_refresh(form_id, current_user["id"])
+    
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        rankings_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 # ==================== Error Handlers ====================
 
@@ -325,7 +435,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         content={
             "error": exc.detail,
             "status_code": exc.status_code
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
@@ -0,0 +1,208 @@
+"""
+Prometheus metrics for the API Gateway
+Hot-path metrics are plain counters/histograms; pool and queue gauges are read
+only when /metrics is scraped. Under gunicorn (PROMETHEUS_MULTIPROC_DIR set)
+metrics are aggregated across workers, and each worker publishes its gauges
+periodically instead
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Set by gunicorn.conf.py before the app (and prometheus_client) is imported
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+STATE_PUBLISH_INTERVAL = 5.0
+
+# Latency buckets (seconds) covering cache hits through slow upstream calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_LATENCY = Histogram(
+    "gateway_request_duration_seconds",
+    "Gateway request latency by route template, method and status",
+    ["route", "method", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "gateway_upstream_request_duration_seconds",
+    "Latency of individual upstream call attempts",
+    ["service", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "gateway_upstream_errors_total",
+    "Upstream call failures by kind (connection, timeout, server_error, circuit_open)",
+    ["service", "kind"],
+)
+DB_POOL_WAIT = Histogram(
+    "gateway_db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0),
+)
+DB_READ_ROUTING = Counter(
+    "gateway_db_read_routing_total",
+    "Read-only connection checkouts by where they went (replica, primary_fallback)",
+    ["target"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "gateway_db_query_duration_seconds",
+    "Round trip of registered queries (queries.py), by query name",
+    ["query"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+PASSWORD_HASH_LATENCY = Histogram(
+    "gateway_password_hash_duration_seconds",
+    "bcrypt hash/verify time including queueing, by operation",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0),
+)
+RATE_LIMIT_REJECTIONS = Counter(
+    "gateway_rate_limit_rejections_total",
+    "Requests rejected by the rate limiter, by route",
+    ["route"],
+)
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per matched route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(
+                _route_template(scope), scope["method"], str(status_code)
+            ).observe(time.perf_counter() - start)
+
+def _route_template(scope) -> str:
+    """Route path template for a request; unmatched paths share one label to bound cardinality"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Older routers don't store the route in scope: match against the app's routes
+    app = scope.get("app")
+    for candidate in getattr(app, "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", "unmatched")
+    return "unmatched"
+
+def _state_samples(db_pool_status: Callable[[], dict],
+                   hasher_status: Callable[[], dict]) -> Iterator[Tuple[str, str, float]]:
+    """(name, help, value) for each scrape-time gauge"""
+    pool = db_pool_status()
+    if "error" not in pool:
+        for name, key, doc in (
+            ("gateway_db_pool_connections_in_use", "in_use", "Connections checked out of the pool"),
+            ("gateway_db_pool_connections_idle", "available", "Open connections idle in the pool"),
+            ("gateway_db_pool_connections_open", "open", "Connections currently open"),
+            ("gateway_db_pool_connections_max", "max_connections", "Pool size limit"),
+            ("gateway_db_pool_requests_waiting", "requests_waiting", "Callers waiting for a connection"),
+        ):
+            yield name, doc, pool[key]
+
+    hasher = hasher_status()
+    yield "gateway_password_hash_queue_depth", "Hash jobs waiting for a worker", hasher["queue_depth"]
+    yield "gateway_password_hash_in_flight", "Hash jobs running", hasher["in_flight"]
+
+class GatewayStateCollector:
+    """Gauges computed at scrape time from the live pools"""
+
+    def __init__(self, db_pool_status: Callable[[], dict], hasher_status: Callable[[], dict]):
+        self.db_pool_status = db_pool_status
+        self.hasher_status = hasher_status
+
+    def collect(self):
+        for name, doc, value in _state_samples(self.db_pool_status, self.hasher_status):
+            yield GaugeMetricFamily(name, doc, value=value)
+
+class StateGaugePublisher:
+    """Multiprocess mode: each worker writes its pool gauges; scrapes sum live workers"""
+
+    def __init__(self, db_pool_status: Callable[[], dict], hasher_status: Callable[[], dict]):
+        self.db_pool_status = db_pool_status
+        self.hasher_status = hasher_status
+        self._gauges: Dict[str, Gauge] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self):
+        for name, doc, value in _state_samples(self.db_pool_status, self.hasher_status):
+            gauge = self._gauges.get(name)
+            if gauge is None:
+                gauge = self._gauges[name] = Gauge(name, doc, multiprocess_mode="livesum")
+            gauge.set(value)
+
+    async def _run(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                logger.warning(f"Failed to publish pool gauges: {e}")
+            await asyncio.sleep(STATE_PUBLISH_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+_state_publisher: Optional[StateGaugePublisher] = None
+
+def register_state_collector(db_pool_status: Callable[[], dict], hasher_status: Callable[[], dict]):
+    """Register the scrape-time gauges (call once at import of the app)"""
+    global _state_publisher
+    if MULTIPROCESS:
+        _state_publisher = StateGaugePublisher(db_pool_status, hasher_status)
+    else:
+        REGISTRY.register(GatewayStateCollector(db_pool_status, hasher_status))
+
+def start_metrics():
+    """Start publishing per-worker gauges in multiprocess mode (call on startup, after fork)"""
+    if _state_publisher is not None:
+        _state_publisher.start()
+
+async def stop_metrics():
+    if _state_publisher is not None:
+        await _state_publisher.stop()
+
+def render_metrics() -> bytes:
+    """Exposition-format metrics for this process, or for all workers in multiprocess mode"""
+    if not MULTIPROCESS:
+        return generate_latest()
+    if _state_publisher is not None:
+        _state_publisher.publish()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
@@ -1,6 +1,6 @@
 """Pydantic models for API Gateway"""
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 # ==================== User Models ====================
@@ -83,6 +83,15 @@ class AIDetectionResult(BaseModel):
     is_ai_generated: bool
     confidence: float
 
+class BulkAnalysisRequest(BaseModel):
+    """Request to analyze every submission of a form"""
+    analyses: List[Literal["plagiarism", "ai"]] = Field(default=["plagiarism", "ai"], min_length=1)
+    chunk_size: Optional[int] = Field(None, ge=1, le=1000)
+    concurrency: Optional[int] = Field(None, ge=1)
+    only_missing: bool = True  # skip analyses that already have a stored result
+    resume_run_id: Optional[str] = None  # continue from a previous run's checkpoint
+    after_submission_id: Optional[int] = Field(None, ge=0)  # explicit checkpoint
+
 # ==================== Error Models ====================
 
 class ErrorResponse(BaseModel):
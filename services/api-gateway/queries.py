@@ -0,0 +1,48 @@
+"""
+Named query registry for the API Gateway
+Hot-path SQL is registered once under a name and executed by that name.
+Registered queries are sent as server-side prepared statements: each pooled
+connection parses and plans a query the first time it runs it and then only
+binds and executes it. Every execution is timed per query name
+"""
+import time
+import logging
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+from config import settings
+from metrics import DB_QUERY_LATENCY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# name -> SQL text; psycopg keys its per-connection prepared statements by the text
+QUERIES: Dict[str, str] = {}
+
+# Positional (%s) or named (%(name)s) parameters, matching the registered SQL
+Params = Optional[Union[Sequence, Mapping]]
+
+def register(name: str, sql: str) -> str:
+    """Register `sql` under `name` (at import time) and return the name"""
+    existing = QUERIES.get(name)
+    if existing is not None and existing != sql:
+        raise ValueError(f"Query {name!r} is already registered with different SQL")
+    QUERIES[name] = sql
+    return name
+
+async def execute(cursor, name: str, params: Params = None):
+    """Execute a registered query on `cursor`, preparing it on first use per connection"""
+    sql = QUERIES[name]
+    start = time.perf_counter()
+    try:
+        # prepare=False also keeps psycopg's own prepare_threshold from preparing it
+        return await cursor.execute(sql, params, prepare=settings.DB_PREPARED_STATEMENTS)
+    finally:
+        DB_QUERY_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+async def fetchone(cursor, name: str, params: Params = None):
+    await execute(cursor, name, params)
+    return await cursor.fetchone()
+
+async def fetchall(cursor, name: str, params: Params = None):
+    await execute(cursor, name, params)
+    return await cursor.fetchall()
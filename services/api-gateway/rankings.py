@@ -0,0 +1,223 @@
+"""
+Rankings response cache for the API Gateway
+Serves /api/forms/{form_id}/rankings from Redis (or an in-process fallback)
+with strong ETags and stale-while-revalidate. Entries are invalidated when
+analysis_results or submissions.rank change, via Postgres NOTIFY
+"""
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+import httpx
+import psycopg
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from fastapi import HTTPException, status
+
+from cache import TTLCache
+from config import settings
+from database import DATABASE_URL
+from upstream import RANKING, call_upstream
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "rankings:"
+INVALIDATION_CHANNEL = "rankings_invalidate"
+
+@dataclass
+class CachedResponse:
+    """A cached upstream body with its strong ETag"""
+    body: bytes
+    etag: str
+    stored_at: float
+
+    def is_stale(self) -> bool:
+        return time.time() - self.stored_at > settings.RANKINGS_CACHE_FRESH_SECONDS
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag derived from the exact response bytes"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against our ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+class RankingsCache:
+    """Two-tier (local + optional Redis) cache of rankings responses by form id"""
+
+    def __init__(self, max_size: int, stale_seconds: float, redis_url: Optional[str] = None):
+        self.local = TTLCache(max_size=max_size, ttl_seconds=stale_seconds)
+        self.stale_seconds = stale_seconds
+        self.redis_url = redis_url
+        self._redis: Optional[aioredis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._refreshing: Set[int] = set()
+        # Held so background refreshes are not garbage collected mid-flight
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        # Bumped by every invalidation; a fetch that started before one must not store its body
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        self.revalidations = 0
+        self.not_modified = 0
+
+    async def start(self):
+        """Connect Redis and listen for invalidations (call on startup)"""
+        if self.redis_url and self._redis is None:
+            self._redis = aioredis.from_url(self.redis_url)
+        if settings.RANKINGS_CACHE_LISTEN and self._listener is None:
+            self._listener = asyncio.create_task(self._listen_for_invalidations())
+
+    async def stop(self):
+        """Stop the listener and close Redis (call on shutdown)"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def _listen_for_invalidations(self):
+        """LISTEN for form ids whose rankings changed (see notify_rankings_invalidate)"""
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+                    async for notify in conn.notifies():
+                        if notify.payload:
+                            await self.invalidate(int(notify.payload))
+            except asyncio.CancelledError:
+                raise
+            except (psycopg.Error, ValueError) as e:
+                # Missed notifications while disconnected: drop what we hold locally
+                self._generations.clear()
+                self._epoch += 1
+                self.local.clear()
+                logger.warning(f"Rankings invalidation listener error, reconnecting: {e}")
+                await asyncio.sleep(5)
+
+    async def get(self, form_id: int) -> Optional[CachedResponse]:
+        entry = self.local.get(form_id)
+        if entry is not None or self._redis is None:
+            return entry
+        try:
+            raw = await self._redis.get(f"{REDIS_KEY_PREFIX}{form_id}")
+        except RedisError as e:
+            logger.warning(f"Rankings cache Redis read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        entry = CachedResponse(body=data["body"].encode('utf-8'), etag=data["etag"], stored_at=data["stored_at"])
+        remaining = self.stale_seconds - (time.time() - entry.stored_at)
+        self.local.set(form_id, entry, ttl_seconds=remaining)
+        return entry
+
+    def generation(self, form_id: int) -> Tuple[int, int]:
+        """Take before fetching; pass to set() so a fetch overtaken by an invalidation isn't stored"""
+        return self._epoch, self._generations.get(form_id, 0)
+
+    async def set(self, form_id: int, body: bytes,
+                  generation: Optional[Tuple[int, int]] = None) -> CachedResponse:
+        """Cache a body and return its entry (returned but not stored if `generation` is outdated)"""
+        entry = CachedResponse(body=body, etag=make_etag(body), stored_at=time.time())
+        if generation is not None and generation != self.generation(form_id):
+            return entry
+        self.local.set(form_id, entry)
+        if self._redis is not None:
+            payload = json.dumps({"body": body.decode('utf-8'), "etag": entry.etag, "stored_at": entry.stored_at})
+            try:
+                await self._redis.set(f"{REDIS_KEY_PREFIX}{form_id}", payload, ex=int(self.stale_seconds))
+            except RedisError as e:
+                logger.warning(f"Rankings cache Redis write failed: {e}")
+        return entry
+
+    async def invalidate(self, form_id: int):
+        """Drop a form's rankings from both tiers"""
+        if len(self._generations) >= self.local.max_size:
+            # Bounded: restarting the epoch outdates every in-flight fetch at once
+            self._generations.clear()
+            self._epoch += 1
+        self._generations[form_id] = self._generations.get(form_id, 0) + 1
+        self.local.invalidate(form_id)
+        if self._redis is not None:
+            try:
+                await self._redis.delete(f"{REDIS_KEY_PREFIX}{form_id}")
+            except RedisError as e:
+                logger.warning(f"Rankings cache Redis invalidation failed: {e}")
+
+    def schedule_refresh(self, form_id: int, user_id: int):
+        """Revalidate a stale entry in the background (one refresh per form at a time)"""
+        if form_id in self._refreshing:
+            return
+        self._refreshing.add(form_id)
+        self.revalidations += 1
+
+        async def refresh():
+            try:
+                await fetch_rankings(form_id, user_id)
+            except Exception as e:
+                logger.warning(f"Background rankings refresh failed for form {form_id}: {e}")
+            finally:
+                self._refreshing.discard(form_id)
+
+        task = asyncio.create_task(refresh())
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.local.get_stats(),
+            "redis_enabled": self._redis is not None,
+            "background_revalidations": self.revalidations,
+            "not_modified_responses": self.not_modified,
+        }
+
+rankings_cache = RankingsCache(
+    max_size=settings.RANKINGS_CACHE_MAX_SIZE,
+    stale_seconds=settings.RANKINGS_CACHE_STALE_SECONDS,
+    redis_url=settings.REDIS_URL if settings.RANKINGS_CACHE_REDIS_ENABLED else None,
+)
+
+async def fetch_rankings(form_id: int, user_id: int) -> Tuple[httpx.Response, Optional[CachedResponse]]:
+    """Call the ranking service, caching successful responses
+
+    Returns the response and, for a 200 with caching enabled, the entry built
+    from it. Use that entry rather than reading the cache back: an
+    invalidation may have removed it already, or the TTL may keep it out.
+    """
+    generation = rankings_cache.generation(form_id)
+    try:
+        response = await call_upstream(
+            RANKING, "GET", f"/rankings/{form_id}", idempotent=True,
+            headers={"X-User-ID": str(user_id)}
+        )
+    except httpx.RequestError as e:
+        logger.error(f"Error calling ranking service: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Ranking service unavailable"
+        )
+    entry = None
+    if settings.RANKINGS_CACHE_ENABLED and response.status_code == 200:
+        entry = await rankings_cache.set(form_id, response.content, generation)
+    return response, entry
+
+async def invalidate_rankings(form_id: int):
+    """Drop a form's cached rankings; call after writing analysis_results or submissions.rank"""
+    await rankings_cache.invalidate(form_id)
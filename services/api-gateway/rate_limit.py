@@ -0,0 +1,234 @@
+"""
+Cluster-wide rate limiting for the API Gateway
+Each worker decides locally with a token bucket plus its last view of a
+sliding window kept in Redis; local hits are pushed to Redis in batches by a
+background task, so requests never wait on a network round trip
+"""
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Optional, Set, Tuple
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+from fastapi import HTTPException, Request, status
+
+from config import settings
+from metrics import RATE_LIMIT_REJECTIONS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+REDIS_KEY_PREFIX = "ratelimit:"
+
+def parse_limit(spec: str) -> Tuple[int, int]:
+    """Parse '10/minute' into (10, 60)"""
+    count, _, period = spec.partition("/")
+    return int(count), WINDOW_SECONDS[period.strip().rstrip("s")]
+
+def get_remote_address(request: Request) -> str:
+    """Client address of the request"""
+    return request.client.host if request.client else "127.0.0.1"
+
+class RateLimitExceeded(HTTPException):
+    """429 with a Retry-After hint"""
+
+    def __init__(self, spec: str, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded: {spec}",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class _KeyState:
+    """Per-(route, client) limiter state held by one worker"""
+    __slots__ = ("tokens", "refilled_at", "window", "curr", "prev", "pending", "inflight",
+                 "synced_at", "syncing")
+
+    def __init__(self, limit: int, now: float):
+        self.tokens = float(limit)
+        self.refilled_at = now
+        self.window = 0      # window index the counts below belong to
+        self.curr = 0        # cluster hits in that window (as of last sync)
+        self.prev = 0        # cluster hits in the window before it
+        self.pending = 0     # local hits not yet pushed to Redis
+        self.inflight = 0    # local hits being pushed right now
+        self.synced_at = 0.0
+        self.syncing = False
+
+class ClusterRateLimiter:
+    """Token bucket fast path over a batched, Redis-backed sliding window"""
+
+    def __init__(self, enabled: bool, redis_url: Optional[str], sync_interval: float,
+                 sync_batch: int, max_keys: int):
+        self.enabled = enabled
+        self.redis_url = redis_url
+        self.sync_interval = sync_interval
+        self.sync_batch = sync_batch
+        self.max_keys = max_keys
+        self._redis: Optional[aioredis.Redis] = None
+        self._states: "OrderedDict[str, _KeyState]" = OrderedDict()
+        self._sync_tasks: Set[asyncio.Task] = set()
+        self._redis_failing = False
+        self.allowed = 0
+        self.rejected = 0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    async def start(self):
+        """Connect to Redis (call on startup); without it limits are per process"""
+        if self.redis_url and self._redis is None:
+            self._redis = aioredis.from_url(self.redis_url)
+
+    async def stop(self):
+        """Flush outstanding hits and close Redis (call on shutdown)"""
+        if self._sync_tasks:
+            await asyncio.gather(*self._sync_tasks, return_exceptions=True)
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+
+    def _state(self, key: str, limit: int, now: float) -> _KeyState:
+        state = self._states.get(key)
+        if state is None:
+            state = _KeyState(limit, now)
+            self._states[key] = state
+            while len(self._states) > self.max_keys:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(key)
+        return state
+
+    @staticmethod
+    def _estimate(state: _KeyState, window: int, elapsed_fraction: float) -> float:
+        """Sliding-window estimate of cluster hits, including unsynced local ones"""
+        if state.window == window:
+            synced = state.prev * (1 - elapsed_fraction) + state.curr
+        elif state.window == window - 1:
+            synced = state.curr * (1 - elapsed_fraction)
+        else:
+            synced = 0
+        return synced + state.pending + state.inflight
+
+    @staticmethod
+    def _roll(state: _KeyState, window: int):
+        if state.window != window:
+            state.prev = state.curr if state.window == window - 1 else 0
+            state.curr = 0
+            state.window = window
+
+    def hit(self, key: str, limit: int, period: int) -> bool:
+        """Record a request; returns False if it must be rejected"""
+        now = time.time()
+        window, offset = divmod(now, period)
+        window = int(window)
+        state = self._state(key, limit, now)
+
+        # Local token bucket: refills at limit/period, bursts up to limit
+        state.tokens = min(limit, state.tokens + (now - state.refilled_at) * limit / period)
+        state.refilled_at = now
+
+        if self._estimate(state, window, offset / period) + 1 > limit or state.tokens < 1:
+            self.rejected += 1
+            self._maybe_sync(key, state, period, now, force=True)
+            return False
+
+        state.tokens -= 1
+        state.pending += 1
+        self.allowed += 1
+        self._maybe_sync(key, state, period, now)
+        return True
+
+    def _maybe_sync(self, key: str, state: _KeyState, period: int, now: float, force: bool = False):
+        if self._redis is None or (self._redis_failing and not force):
+            # Per-process window: fold local hits in immediately
+            self._roll(state, int(now // period))
+            state.curr += state.pending
+            state.pending = 0
+            if self._redis is None:
+                return
+        due = force or state.pending >= self.sync_batch or now - state.synced_at >= self.sync_interval
+        if due and not state.syncing and now - state.synced_at >= self.sync_interval / 10:
+            state.syncing = True
+            task = asyncio.get_running_loop().create_task(self._sync(key, state, period))
+            self._sync_tasks.add(task)
+            task.add_done_callback(self._sync_tasks.discard)
+
+    async def _sync(self, key: str, state: _KeyState, period: int):
+        """Push pending hits to Redis and pull the cluster's window counts"""
+        amount, state.pending = state.pending, 0
+        state.inflight = amount
+        window = int(time.time() // period)
+        curr_key = f"{REDIS_KEY_PREFIX}{key}:{window}"
+        prev_key = f"{REDIS_KEY_PREFIX}{key}:{window - 1}"
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.incrby(curr_key, amount)
+            pipe.expire(curr_key, period * 2 + 1)
+            pipe.get(prev_key)
+            curr, _, prev = await pipe.execute()
+            state.window, state.curr, state.prev = window, int(curr), int(prev or 0)
+            self.syncs += 1
+            if self._redis_failing:
+                logger.info("Rate limiter Redis sync recovered")
+                self._redis_failing = False
+        except (RedisError, OSError) as e:
+            # Keep counting locally until Redis is back
+            self.sync_errors += 1
+            self._roll(state, window)
+            state.curr += amount
+            if not self._redis_failing:
+                logger.warning(f"Rate limiter Redis sync failed, limiting per process: {e}")
+                self._redis_failing = True
+        finally:
+            state.inflight = 0
+            state.synced_at = time.time()
+            state.syncing = False
+
+    def limit(self, spec: str):
+        """Route decorator, e.g. @limiter.limit("10/minute"); the route needs a `request` param"""
+        limit, period = parse_limit(spec)
+
+        def decorator(func):
+            scope = f"{func.__module__}.{func.__name__}"
+            rejections = RATE_LIMIT_REJECTIONS.labels(func.__name__)
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if self.enabled:
+                    user = kwargs.get("current_user")
+                    if isinstance(user, dict) and user.get("id") is not None:
+                        identity = f"user:{user['id']}"
+                    else:
+                        identity = f"ip:{get_remote_address(kwargs['request'])}"
+                    if not self.hit(f"{scope}:{identity}", limit, period):
+                        rejections.inc()
+                        raise RateLimitExceeded(spec, retry_after=max(1, math.ceil(period / limit)))
+                return await func(*args, **kwargs)
+
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "redis_enabled": self._redis is not None,
+            "redis_failing": self._redis_failing,
+            "tracked_keys": len(self._states),
+            "allowed_total": self.allowed,
+            "rejected_total": self.rejected,
+            "syncs_total": self.syncs,
+            "sync_errors_total": self.sync_errors,
+        }
+
+limiter = ClusterRateLimiter(
+    enabled=settings.RATE_LIMIT_ENABLED,
+    redis_url=settings.REDIS_URL if settings.RATE_LIMIT_REDIS_ENABLED else None,
+    sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL,
+    sync_batch=settings.RATE_LIMIT_SYNC_BATCH,
+    max_keys=settings.RATE_LIMIT_MAX_KEYS,
+)
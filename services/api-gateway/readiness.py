@@ -0,0 +1,92 @@
+"""
+Readiness probe for the API Gateway
+Ready only between the end of startup warm-up and the start of shutdown, and
+only while the database answers. Redis and the upstreams are probed and
+reported; they gate readiness when READY_REQUIRE_REDIS / READY_REQUIRED_UPSTREAMS
+say so, since the gateway degrades gracefully without them
+"""
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from config import settings
+from database import check_db_connection
+from upstream import SERVICE_SETTINGS_PREFIX, check_upstream
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_accepting = False
+_redis: Optional[aioredis.Redis] = None
+
+def redis_in_use() -> bool:
+    """Whether any Redis-backed feature is enabled"""
+    return (
+        (settings.RATE_LIMIT_ENABLED and settings.RATE_LIMIT_REDIS_ENABLED)
+        or (settings.USER_CACHE_ENABLED and settings.USER_CACHE_REDIS_ENABLED)
+        or (settings.RANKINGS_CACHE_ENABLED and settings.RANKINGS_CACHE_REDIS_ENABLED)
+    )
+
+async def start_readiness():
+    """Connect the Redis probe client and start reporting ready (call last on startup)"""
+    global _redis, _accepting
+    if redis_in_use() and _redis is None:
+        _redis = aioredis.from_url(settings.REDIS_URL)
+    _accepting = True
+    logger.info("Gateway ready to accept traffic")
+
+def stop_accepting():
+    """Report not-ready so load balancers stop routing here (call first on shutdown)"""
+    global _accepting
+    _accepting = False
+
+async def stop_readiness():
+    """Close the Redis probe client (call on shutdown)"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+async def _check_redis() -> bool:
+    try:
+        return bool(await _redis.ping())
+    except RedisError as e:
+        logger.warning(f"Redis readiness check failed: {e}")
+        return False
+
+async def _with_timeout(check, default):
+    try:
+        return await asyncio.wait_for(check, timeout=settings.READY_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        return default
+
+async def check_readiness() -> Tuple[bool, dict]:
+    """Run all dependency checks concurrently; returns (ready, per-check detail)"""
+    timeout = settings.READY_CHECK_TIMEOUT
+    names = list(SERVICE_SETTINGS_PREFIX)
+    checks = [_with_timeout(check_db_connection(timeout), False)]
+    checks += [_with_timeout(check_upstream(name, timeout), {"reachable": False}) for name in names]
+    if _redis is not None:
+        checks.append(_with_timeout(_check_redis(), False))
+    results = await asyncio.gather(*checks)
+
+    database_ok = results[0]
+    upstreams = dict(zip(names, results[1:1 + len(names)]))
+    redis_ok = results[-1] if _redis is not None else None
+
+    required = [name.strip() for name in settings.READY_REQUIRED_UPSTREAMS.split(",") if name.strip()]
+    ready = (
+        _accepting
+        and database_ok
+        and (redis_ok is not False or not settings.READY_REQUIRE_REDIS)
+        and all(upstreams.get(name, {}).get("reachable") for name in required)
+    )
+    return ready, {
+        "accepting_traffic": _accepting,
+        "database": database_ok,
+        "redis": redis_ok,
+        "upstreams": upstreams,
+    }
@@ -0,0 +1,91 @@
+"""
+Resilience primitives for upstream calls
+Circuit breaker with half-open probing and a rolling latency tracker used to
+decide when to hedge a slow request
+"""
+import time
+import random
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets probe calls through after a cool-down"""
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_opened_at = 0.0
+        self._probes_in_flight = 0
+        self.opened_total = 0
+        self.rejected_total = 0
+
+    def allow(self) -> bool:
+        """Whether a call may proceed right now"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_seconds:
+                self.rejected_total += 1
+                return False
+            self.state = HALF_OPEN
+            self.half_opened_at = time.monotonic()
+            self._probes_in_flight = 0
+        if self.state == HALF_OPEN:
+            # A probe that never reported back (e.g. cancelled) must not wedge the breaker
+            if time.monotonic() - self.half_opened_at > self.recovery_seconds:
+                self.half_opened_at = time.monotonic()
+                self._probes_in_flight = 0
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.rejected_total += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self._probes_in_flight = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened_total += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._probes_in_flight = 0
+
+    def get_status(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened_total": self.opened_total,
+            "rejected_total": self.rejected_total,
+        }
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies (seconds)"""
+
+    def __init__(self, size: int = 500):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> float:
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float = 2.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
@@ -0,0 +1,257 @@
+"""
+Submission queries for the API Gateway
+Keyset (cursor) pagination over (form_id, submitted_at, id) and NDJSON streaming
+from a server-side cursor, so memory stays flat for forms of any size
+"""
+import json
+import time
+import base64
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Optional, Tuple
+
+import httpx
+import psycopg
+from fastapi import HTTPException, status
+
+from analysis import ANALYSIS_TYPES
+from config import settings
+from database import get_db_connection
+from queries import register, fetchone, fetchall
+from upstream import PLAGIARISM, AI_DETECTION, RANKING, call_upstream
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip when streaming from the server-side cursor
+STREAM_FETCH_SIZE = 1000
+
+SUBMISSION_COLUMNS = """
+    id, form_id, submitter_name, submitter_email, submitted_at,
+    plagiarism_score, ai_score, quality_score, status, rank, data
+"""
+
+def encode_cursor(submitted_at: datetime, submission_id: int) -> str:
+    """Opaque cursor pointing just past a row"""
+    raw = f"{submitted_at.isoformat()}|{submission_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Parse a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        submitted_at, submission_id = raw.split("|", 1)
+        return datetime.fromisoformat(submitted_at), int(submission_id)
+    except (ValueError, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def _keyset_query(after_cursor: bool) -> str:
+    """Newest-first listing, served by idx_submissions_form_submitted_id
+
+    The plain `submitted_at <=` bound duplicates the row comparison so the
+    planner can prune the monthly partitions newer than the cursor.
+    """
+    where = "form_id = %s"
+    if after_cursor:
+        where += " AND submitted_at <= %s AND (submitted_at, id) < (%s, %s)"
+    return f"""
+        SELECT {SUBMISSION_COLUMNS}
+        FROM submissions
+        WHERE {where}
+        ORDER BY submitted_at DESC, id DESC
+    """
+
+def _keyset_params(form_id: int, after: Optional[Tuple[datetime, int]]) -> tuple:
+    return (form_id, after[0], *after) if after else (form_id,)
+
+# Page queries are registered (and prepared); the NDJSON stream goes through a
+# server-side cursor (DECLARE), which cannot use a prepared statement
+SUBMISSIONS_PAGE = register("submissions_page", _keyset_query(False) + " LIMIT %s")
+SUBMISSIONS_PAGE_AFTER = register("submissions_page_after", _keyset_query(True) + " LIMIT %s")
+FORM_OWNER = register("form_owner", "SELECT 1 FROM forms WHERE id = %s AND user_id = %s")
+OWNED_SUBMISSION = register("owned_submission", """
+    SELECT s.id, s.form_id, s.submitted_at, s.status, s.rank,
+           s.plagiarism_score, s.ai_score, s.quality_score
+    FROM submissions s
+    JOIN forms f ON f.id = s.form_id
+    WHERE s.id = %s AND f.user_id = %s
+""")
+LATEST_ANALYSIS_RESULTS = register("latest_analysis_results", """
+    SELECT DISTINCT ON (analysis_type) analysis_type, score, details, created_at
+    FROM analysis_results
+    WHERE submission_id = %s
+    ORDER BY analysis_type, created_at DESC
+""")
+
+async def ensure_form_owner(form_id: int, user_id: int):
+    """Raise 404 unless the form belongs to the user"""
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.cursor() as cursor:
+            if await fetchone(cursor, FORM_OWNER, (form_id, user_id)) is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Form not found"
+                )
+
+async def fetch_submissions_page(form_id: int, limit: int,
+                                 after: Optional[Tuple[datetime, int]] = None) -> dict:
+    """Fetch one page of submissions plus the cursor for the next page"""
+    params = _keyset_params(form_id, after)
+
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.cursor() as cur:
+            # Fetch one extra row to know whether another page exists
+            query = SUBMISSIONS_PAGE_AFTER if after else SUBMISSIONS_PAGE
+            rows = await fetchall(cur, query, (*params, limit + 1))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last["submitted_at"], last["id"])
+
+    return {
+        "form_id": form_id,
+        "submissions": rows,
+        "next_cursor": next_cursor
+    }
+
+async def stream_submissions(form_id: int,
+                             after: Optional[Tuple[datetime, int]] = None) -> AsyncIterator[bytes]:
+    """Yield every submission (after the cursor position) as NDJSON lines"""
+    params = _keyset_params(form_id, after)
+
+    async with get_db_connection(read_only=True) as conn:
+        # Named cursor = server-side cursor; rows arrive STREAM_FETCH_SIZE at a time
+        async with conn.cursor(name=f"stream_submissions_{form_id}") as cur:
+            cur.itersize = STREAM_FETCH_SIZE
+            await cur.execute(_keyset_query(after is not None), params)
+            count = 0
+            async for row in cur:
+                count += 1
+                yield json.dumps(row, default=str).encode('utf-8') + b"\n"
+    logger.info(f"Streamed {count} submissions for form {form_id}")
+
+# ==================== Submission Detail ====================
+
+async def get_owned_submission(submission_id: int, user_id: int) -> dict:
+    """Load a submission row, raising 404 unless its form belongs to the user"""
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.cursor() as cursor:
+            submission = await fetchone(cursor, OWNED_SUBMISSION, (submission_id, user_id))
+    if submission is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Submission not found"
+        )
+    return submission
+
+async def _fetch_analysis_results(submission_id: int) -> dict:
+    """Latest stored result per analysis type"""
+    async with get_db_connection(read_only=True) as conn:
+        async with conn.cursor() as cursor:
+            rows = await fetchall(cursor, LATEST_ANALYSIS_RESULTS, (submission_id,))
+            return {row["analysis_type"]: row for row in rows}
+
+async def _fetch_upstream(service: str, path: str, user_id: int, timeout: float) -> dict:
+    """GET a JSON result from an upstream service"""
+    response = await call_upstream(
+        service, "GET", path, idempotent=True,
+        headers={"X-User-ID": str(user_id)}, timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, dict):
+        raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+    return data
+
+async def _run_source(call: Awaitable, deadline: float) -> dict:
+    """Run one source under its own deadline and report its status"""
+    start = time.perf_counter()
+    try:
+        data = await asyncio.wait_for(call, timeout=deadline)
+        result = {"status": "ok", "data": data}
+    except asyncio.TimeoutError:
+        result = {"status": "timeout"}
+    except httpx.HTTPStatusError as e:
+        result = {"status": "error", "detail": f"upstream returned {e.response.status_code}"}
+    except ValueError as e:
+        # A 2xx whose body isn't a JSON object
+        logger.warning(f"Submission detail source returned an unusable body: {e}")
+        result = {"status": "error", "detail": "invalid upstream response"}
+    except (httpx.RequestError, psycopg.Error) as e:
+        logger.warning(f"Submission detail source failed: {e}")
+        result = {"status": "unavailable"}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+async def get_submission_detail(submission_id: int, user_id: int) -> dict:
+    """Aggregate plagiarism, AI detection, quality and stored analysis results
+
+    All sources are queried concurrently, each under its own deadline and all
+    under one overall budget. Slow or failing sources are reported per field
+    and the response comes back partial instead of waiting on them.
+    """
+    submission = await get_owned_submission(submission_id, user_id)
+
+    sources = {
+        "plagiarism": _run_source(
+            _fetch_upstream(PLAGIARISM, f"/results/{submission_id}", user_id,
+                            settings.DETAIL_PLAGIARISM_TIMEOUT),
+            settings.DETAIL_PLAGIARISM_TIMEOUT
+        ),
+        "ai_detection": _run_source(
+            _fetch_upstream(AI_DETECTION, f"/results/{submission_id}", user_id,
+                            settings.DETAIL_AI_DETECTION_TIMEOUT),
+            settings.DETAIL_AI_DETECTION_TIMEOUT
+        ),
+        "quality": _run_source(
+            _fetch_upstream(RANKING, f"/scores/{submission_id}", user_id,
+                            settings.DETAIL_RANKING_TIMEOUT),
+            settings.DETAIL_RANKING_TIMEOUT
+        ),
+        "analysis_results": _run_source(
+            _fetch_analysis_results(submission_id),
+            settings.DETAIL_DATABASE_TIMEOUT
+        ),
+    }
+    tasks = {name: asyncio.create_task(call) for name, call in sources.items()}
+    done, pending = await asyncio.wait(tasks.values(), timeout=settings.DETAIL_TOTAL_BUDGET)
+    for task in pending:
+        task.cancel()
+
+    results = {
+        name: task.result() if task in done else {"status": "timeout"}
+        for name, task in tasks.items()
+    }
+
+    def score(source: str, field: str, stored: str, scale: float = 1.0):
+        """Prefer the live upstream value (scaled to the stored column's 0-100), fall back to the column"""
+        result = results[source]
+        if result["status"] == "ok" and result["data"].get(field) is not None:
+            try:
+                return int(round(float(result["data"][field]) * scale))
+            except (TypeError, ValueError):
+                pass
+        return submission[stored]
+
+    plagiarism, ai = ANALYSIS_TYPES["plagiarism"], ANALYSIS_TYPES["ai"]
+
+    return {
+        "submission_id": submission_id,
+        "form_id": submission["form_id"],
+        "submitted_at": submission["submitted_at"],
+        "status": submission["status"],
+        "rank": submission["rank"],
+        "plagiarism_score": score("plagiarism", plagiarism.score_field, plagiarism.column, plagiarism.score_scale),
+        "ai_score": score("ai_detection", ai.score_field, ai.column, ai.score_scale),
+        "quality_score": score("quality", "quality_score", "quality_score"),
+        "sources": results,
+        "partial": any(result["status"] != "ok" for result in results.values())
+    }
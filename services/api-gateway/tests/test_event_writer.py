@@ -0,0 +1,109 @@
+"""
+Shutdown guarantees of the write-behind event writer: on stop() every
+buffered event is either written or spilled to disk, and spilled events are
+written by the next writer that starts
+"""
+import os
+import glob
+from contextlib import asynccontextmanager
+
+import psycopg
+import pytest
+
+import event_writer
+from event_writer import ACTIVITY_LOG, CREDIT_TRANSACTIONS, EventWriter
+
+class FakeDatabase:
+    """Stands in for get_db_connection, recording the rows each COPY writes"""
+
+    def __init__(self):
+        self.rows = {ACTIVITY_LOG: [], CREDIT_TRANSACTIONS: []}
+        self.down = False
+
+    @asynccontextmanager
+    async def connection(self):
+        if self.down:
+            raise psycopg.OperationalError("connection refused")
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield self
+
+    @asynccontextmanager
+    async def copy(self, statement: str):
+        table = statement.split()[1]
+        yield _FakeCopy(self.rows[table])
+
+class _FakeCopy:
+    def __init__(self, rows: list):
+        self._rows = rows
+
+    async def write_row(self, row: tuple):
+        self._rows.append(tuple(row))
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(event_writer, "get_db_connection", database.connection)
+    return database
+
+def make_writer(spill_dir) -> EventWriter:
+    return EventWriter(batch_size=50, flush_interval=0.05, max_buffer=10000,
+                       enqueue_timeout=1.0, spill_dir=str(spill_dir))
+
+def make_events(count: int) -> list:
+    events = []
+    for i in range(count):
+        if i % 3:
+            events.append((ACTIVITY_LOG, (i, "analysis", f"event {i}", None, "2026-01-01T00:00:00+00:00")))
+        else:
+            events.append((CREDIT_TRANSACTIONS, (i, -1, "usage", f"event {i}", "2026-01-01T00:00:00+00:00")))
+    return events
+
+def expected_rows(events: list) -> dict:
+    rows = {ACTIVITY_LOG: [], CREDIT_TRANSACTIONS: []}
+    for table, row in events:
+        rows[table].append(row)
+    return rows
+
+@pytest.mark.asyncio
+async def test_stop_writes_every_buffered_event(database, tmp_path):
+    writer = make_writer(tmp_path)
+    await writer.start()
+    events = make_events(1000)
+    for table, row in events:
+        await writer.record(table, row)
+
+    await writer.stop()
+
+    assert database.rows == expected_rows(events)
+    assert writer.get_stats()["buffered"] == 0
+    assert writer.written == len(events)
+    assert glob.glob(os.path.join(tmp_path, "events-*")) == []
+
+@pytest.mark.asyncio
+async def test_stop_spills_unwritable_events_and_next_start_replays_them(database, tmp_path):
+    events = make_events(300)
+    writer = make_writer(tmp_path)
+    await writer.start()
+    database.down = True
+    for table, row in events:
+        await writer.record(table, row)
+
+    await writer.stop()
+
+    assert database.rows == {ACTIVITY_LOG: [], CREDIT_TRANSACTIONS: []}
+    assert writer.spilled == len(events)
+    spill_files = glob.glob(os.path.join(tmp_path, "events-*.jsonl"))
+    assert len(spill_files) == 1
+    with open(spill_files[0]) as f:
+        assert sum(1 for _ in f) == len(events)
+
+    database.down = False
+    restarted = make_writer(tmp_path)
+    await restarted.start()
+    await restarted.stop()
+
+    assert database.rows == expected_rows(events)
+    assert glob.glob(os.path.join(tmp_path, "events-*")) == []
@@ -0,0 +1,382 @@
+"""
+Shared upstream HTTP clients for the API Gateway
+Keeps one long-lived, connection-pooled httpx.AsyncClient per microservice
+"""
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional
+
+import httpx
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from config import settings
+from metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+from resilience import CircuitBreaker, LatencyTracker, backoff_delay
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Upstream service names
+FORMS = "forms"
+PLAGIARISM = "plagiarism"
+AI_DETECTION = "ai_detection"
+RANKING = "ranking"
+
+# Settings prefix for each upstream (e.g. FORMS_SERVICE_URL, FORMS_SERVICE_TIMEOUT)
+SERVICE_SETTINGS_PREFIX = {
+    FORMS: "FORMS_SERVICE",
+    PLAGIARISM: "PLAGIARISM_SERVICE",
+    AI_DETECTION: "AI_DETECTION_SERVICE",
+    RANKING: "RANKING_SERVICE",
+}
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    """Connection settings for a single upstream service"""
+    name: str
+    base_url: str
+    timeout: float
+    connect_timeout: float
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    http2: bool
+    breaker_failure_threshold: int
+    breaker_recovery_seconds: float
+    retries: int
+    hedge_percentile: float  # 0 disables hedging
+
+def load_upstream_config(name: str) -> UpstreamConfig:
+    """Build the client configuration for an upstream from settings"""
+    prefix = SERVICE_SETTINGS_PREFIX[name]
+    return UpstreamConfig(
+        name=name,
+        base_url=getattr(settings, f"{prefix}_URL"),
+        timeout=getattr(settings, f"{prefix}_TIMEOUT"),
+        connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+        max_connections=getattr(settings, f"{prefix}_MAX_CONNECTIONS"),
+        max_keepalive_connections=getattr(settings, f"{prefix}_MAX_KEEPALIVE"),
+        keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        http2=settings.UPSTREAM_HTTP2,
+        breaker_failure_threshold=getattr(settings, f"{prefix}_BREAKER_FAILURE_THRESHOLD"),
+        breaker_recovery_seconds=getattr(settings, f"{prefix}_BREAKER_RECOVERY_SECONDS"),
+        retries=getattr(settings, f"{prefix}_RETRIES"),
+        hedge_percentile=getattr(settings, f"{prefix}_HEDGE_PERCENTILE"),
+    )
+
+# Long-lived clients, created in the app lifespan
+_clients: Dict[str, httpx.AsyncClient] = {}
+_configs: Dict[str, UpstreamConfig] = {}
+_request_counts: Dict[str, int] = {}
+_error_counts: Dict[str, int] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+_retry_counts: Dict[str, int] = {}
+_hedge_counts: Dict[str, int] = {}
+_hedge_wins: Dict[str, int] = {}
+_coalesced_counts: Dict[str, int] = {}
+# Single-flight: identical in-flight idempotent calls, shared by all concurrent callers
+_inflight: Dict[Hashable, asyncio.Task] = {}
+
+# Status codes worth retrying for idempotent requests
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+# Response headers passed through to the client unchanged when proxying
+PROXIED_RESPONSE_HEADERS = (
+    "content-type", "content-encoding", "content-length", "content-disposition",
+    "cache-control", "etag", "last-modified", "retry-after",
+)
+# Request headers describing a body that is streamed upstream
+PROXIED_REQUEST_HEADERS = ("content-type", "content-encoding")
+
+class CircuitOpenError(httpx.RequestError):
+    """Raised without contacting the upstream while its circuit is open"""
+
+def _build_client(config: UpstreamConfig) -> httpx.AsyncClient:
+    """Create a pooled client for one upstream"""
+    limits = httpx.Limits(
+        max_connections=config.max_connections,
+        max_keepalive_connections=config.max_keepalive_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+    timeout = httpx.Timeout(config.timeout, connect=config.connect_timeout)
+
+    async def count_request(request: httpx.Request):
+        _request_counts[config.name] += 1
+
+    async def count_response(response: httpx.Response):
+        if response.status_code >= 500:
+            _error_counts[config.name] += 1
+
+    kwargs = dict(
+        base_url=config.base_url,
+        limits=limits,
+        timeout=timeout,
+        event_hooks={"request": [count_request], "response": [count_response]},
+    )
+    try:
+        return httpx.AsyncClient(http2=config.http2, **kwargs)
+    except ImportError:
+        # HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+        logger.warning(f"HTTP/2 requested for {config.name} but h2 is not installed, using HTTP/1.1")
+        return httpx.AsyncClient(**kwargs)
+
+async def init_upstream_clients():
+    """Create one pooled client per upstream service (call on startup)"""
+    for name in SERVICE_SETTINGS_PREFIX:
+        if name in _clients:
+            continue
+        config = load_upstream_config(name)
+        _configs[name] = config
+        _request_counts[name] = 0
+        _error_counts[name] = 0
+        _breakers[name] = CircuitBreaker(
+            failure_threshold=config.breaker_failure_threshold,
+            recovery_seconds=config.breaker_recovery_seconds,
+            half_open_max_calls=settings.UPSTREAM_BREAKER_HALF_OPEN_CALLS,
+        )
+        _latencies[name] = LatencyTracker()
+        _retry_counts[name] = 0
+        _hedge_counts[name] = 0
+        _hedge_wins[name] = 0
+        _coalesced_counts[name] = 0
+        _clients[name] = _build_client(config)
+        logger.info(
+            f"Upstream client created for {name} "
+            f"(max={config.max_connections}, keepalive={config.max_keepalive_connections}, "
+            f"http2={config.http2})"
+        )
+
+async def close_upstream_clients():
+    """Close all upstream clients and their pooled connections (call on shutdown)"""
+    for name, client in list(_clients.items()):
+        await client.aclose()
+        del _clients[name]
+    logger.info("All upstream clients closed")
+
+def get_upstream_client(name: str) -> httpx.AsyncClient:
+    """Get the shared client for an upstream service"""
+    try:
+        return _clients[name]
+    except KeyError:
+        raise RuntimeError(f"Upstream client '{name}' is not initialized")
+
+async def _send_hedged(name: str, method: str, path: str, **kwargs) -> httpx.Response:
+    """Send a request; if it outlives the configured latency percentile, race a second copy"""
+    client = _clients[name]
+    config = _configs[name]
+    tracker = _latencies[name]
+    if not config.hedge_percentile or len(tracker) < settings.UPSTREAM_HEDGE_MIN_SAMPLES:
+        return await client.request(method, path, **kwargs)
+
+    delay = tracker.percentile(config.hedge_percentile)
+    primary = asyncio.create_task(client.request(method, path, **kwargs))
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            _hedge_counts[name] += 1
+            tasks.add(asyncio.create_task(client.request(method, path, **kwargs)))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        _hedge_wins[name] += 1
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _coalesce_key(name: str, method: str, path: str, kwargs: dict) -> Optional[Hashable]:
+    """Key identifying an identical read: service, path, query and user scope"""
+    if set(kwargs) - {"headers", "params", "timeout"}:
+        return None
+    headers = kwargs.get("headers") or {}
+    params = kwargs.get("params") or {}
+    return (name, method, path, headers.get("X-User-ID"), tuple(sorted(dict(params).items())))
+
+async def call_upstream(name: str, method: str, path: str, idempotent: bool = False,
+                        **kwargs) -> httpx.Response:
+    """Call an upstream through its circuit breaker
+
+    Idempotent requests (GETs) are also retried with jittered backoff on
+    connection errors and 502/503/504, and hedged once they run past the
+    service's latency percentile. Identical idempotent requests already in
+    flight are coalesced: all callers share one upstream call and its result.
+    Raises CircuitOpenError (an httpx.RequestError) while the circuit is open.
+    """
+    key = _coalesce_key(name, method, path, kwargs) if idempotent and settings.UPSTREAM_COALESCE_ENABLED else None
+    if key is None:
+        return await _call_upstream(name, method, path, idempotent, **kwargs)
+
+    task = _inflight.get(key)
+    if task is not None:
+        _coalesced_counts[name] += 1
+    else:
+        task = asyncio.create_task(_call_upstream(name, method, path, idempotent, **kwargs))
+        _inflight[key] = task
+
+        def finished(done: asyncio.Task):
+            _inflight.pop(key, None)
+            if not done.cancelled():
+                done.exception()  # retrieved here so an unawaited failure is not logged as lost
+
+        task.add_done_callback(finished)
+    # Shielded so one caller going away does not cancel the call for the others
+    return await asyncio.shield(task)
+
+async def _call_upstream(name: str, method: str, path: str, idempotent: bool,
+                         stream: bool = False, **kwargs) -> httpx.Response:
+    """One logical upstream call: breaker, retries and hedging
+
+    With stream=True the response is returned once headers arrive and the
+    caller must close it; streamed calls are never hedged.
+    """
+    client = get_upstream_client(name)
+    config = _configs[name]
+    breaker = _breakers[name]
+    attempts = 1 + (config.retries if idempotent else 0)
+
+    for attempt in range(attempts):
+        if not breaker.allow():
+            UPSTREAM_ERRORS.labels(name, "circuit_open").inc()
+            raise CircuitOpenError(f"Circuit open for upstream '{name}'")
+        if attempt > 0:
+            _retry_counts[name] += 1
+        start = time.perf_counter()
+        try:
+            if stream:
+                response = await client.send(client.build_request(method, path, **kwargs), stream=True)
+            elif idempotent:
+                response = await _send_hedged(name, method, path, **kwargs)
+            else:
+                response = await client.request(method, path, **kwargs)
+        except httpx.RequestError as e:
+            breaker.record_failure()
+            kind = "timeout" if isinstance(e, httpx.TimeoutException) else "connection"
+            UPSTREAM_ERRORS.labels(name, kind).inc()
+            UPSTREAM_LATENCY.labels(name, kind).observe(time.perf_counter() - start)
+            if attempt == attempts - 1:
+                raise
+        else:
+            elapsed = time.perf_counter() - start
+            if response.status_code < 500:
+                breaker.record_success()
+                _latencies[name].record(elapsed)
+                UPSTREAM_LATENCY.labels(name, "ok").observe(elapsed)
+                return response
+            breaker.record_failure()
+            UPSTREAM_ERRORS.labels(name, "server_error").inc()
+            UPSTREAM_LATENCY.labels(name, "server_error").observe(elapsed)
+            if attempt == attempts - 1 or response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            await response.aclose()
+        await asyncio.sleep(backoff_delay(attempt, settings.UPSTREAM_RETRY_BACKOFF_SECONDS))
+
+async def proxy_upstream(name: str, request: Request, path: str,
+                         headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """Pass an upstream response through to the client
+
+    The response is relayed chunk by chunk in its original encoding and is
+    never held in memory. GET/HEAD (and DELETE/OPTIONS) are still retried on
+    connection errors and 502/503/504, but not hedged or coalesced: both
+    would need the body buffered. Requests with a body are streamed upstream
+    as it arrives and sent once. Raises httpx.RequestError (including
+    CircuitOpenError) if no response arrives.
+    """
+    upstream_headers = dict(headers or {})
+    kwargs = {}
+    if request.url.query:
+        kwargs["params"] = request.query_params
+
+    has_body = request.method not in ("GET", "HEAD", "DELETE", "OPTIONS")
+    if has_body:
+        for header in PROXIED_REQUEST_HEADERS:
+            if header in request.headers:
+                upstream_headers[header] = request.headers[header]
+        kwargs["content"] = request.stream()
+
+    response = await _call_upstream(
+        name, request.method, path, idempotent=not has_body, stream=True,
+        headers=upstream_headers, **kwargs
+    )
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        headers={k: v for k, v in response.headers.items() if k in PROXIED_RESPONSE_HEADERS},
+        # Runs after the body is sent or the client disconnects, returning the connection to the pool
+        background=BackgroundTask(response.aclose),
+    )
+
+async def check_upstream(name: str, timeout: float) -> dict:
+    """Probe an upstream's /health endpoint directly (no retries, breaker untouched)"""
+    result = {"reachable": False, "circuit": _breakers[name].state if name in _breakers else None}
+    client = _clients.get(name)
+    if client is None:
+        return result
+    try:
+        response = await client.get("/health", timeout=timeout)
+        result["reachable"] = response.status_code < 500
+    except httpx.RequestError as e:
+        logger.warning(f"Upstream readiness check failed for {name}: {e}")
+    return result
+
+def get_upstream_breaker_status() -> dict:
+    """Circuit breaker, retry and hedging state per upstream"""
+    status = {}
+    for name, breaker in _breakers.items():
+        config = _configs[name]
+        tracker = _latencies[name]
+        status[name] = {
+            **breaker.get_status(),
+            "retries_total": _retry_counts[name],
+            "hedged_total": _hedge_counts[name],
+            "hedge_wins_total": _hedge_wins[name],
+            "hedge_after_ms": round(tracker.percentile(config.hedge_percentile) * 1000, 1)
+            if config.hedge_percentile and len(tracker) >= settings.UPSTREAM_HEDGE_MIN_SAMPLES else None,
+        }
+    return status
+
+def _connection_counts(client: httpx.AsyncClient) -> dict:
+    """Inspect the transport's connection pool (httpcore internals)"""
+    pool = getattr(client._transport, "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    idle = sum(1 for conn in connections if conn.is_idle())
+    waiting = [r for r in getattr(pool, "_requests", []) if getattr(r, "connection", None) is None]
+    return {
+        "open_connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+        "queued_requests": len(waiting),
+    }
+
+def get_upstream_pool_status() -> dict:
+    """Get per-upstream connection pool statistics for monitoring"""
+    status = {}
+    for name, client in _clients.items():
+        config = _configs[name]
+        try:
+            stats = _connection_counts(client)
+        except Exception as e:
+            logger.error(f"Error getting pool status for {name}: {e}")
+            stats = {"error": "Unable to retrieve pool status"}
+        status[name] = {
+            "max_connections": config.max_connections,
+            "max_keepalive_connections": config.max_keepalive_connections,
+            "http2": config.http2,
+            "requests_total": _request_counts[name],
+            "coalesced_total": _coalesced_counts[name],
+            "server_errors_total": _error_counts[name],
+            **stats,
+        }
+    return status
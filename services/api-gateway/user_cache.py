@@ -0,0 +1,237 @@
+"""
+User principal cache for get_current_user
+In-process TTL/LRU tier with an optional shared Redis tier; invalidations are
+broadcast over Redis pub/sub so every gateway replica drops stale principals.
+Changes made outside the gateway (tier, deactivation) arrive via
+Postgres NOTIFY from a trigger on users
+"""
+import json
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import psycopg
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from cache import TTLCache
+from config import settings
+from database import DATABASE_URL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = "user-principal:"
+INVALIDATION_CHANNEL = "user-principal-invalidate"
+# Postgres channel fed by notify_user_principal_invalidate() on users
+PG_INVALIDATION_CHANNEL = "user_principal_invalidate"
+# Per-principal counter bumped by every invalidation; a Redis write is conditional on it
+GENERATION_KEY_PREFIX = "user-principal-gen:"
+# Outlives any load in flight, so an expired counter can't make an old load look current
+GENERATION_TTL_SECONDS = 3600
+
+# Write the entry only if no invalidation has bumped the generation since the load began
+SET_IF_GENERATION_LUA = """
+if (redis.call('GET', KEYS[1]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+class UserPrincipalCache:
+    """Cache of {id, email, tier} rows (credits change too often to cache) keyed by the JWT 'sub' claim"""
+
+    def __init__(self, max_size: int, ttl_seconds: float, redis_url: Optional[str] = None):
+        self.local = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.redis_url = redis_url
+        self._redis: Optional[aioredis.Redis] = None
+        self._set_if_generation = None
+        self._listener: Optional[asyncio.Task] = None
+        self._pg_listener: Optional[asyncio.Task] = None
+        # Bumped by every invalidation; a load that started before one must not be cached
+        self._versions: Dict[str, int] = {}
+        self._epoch = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    async def start(self):
+        """Connect the Redis tier and subscribe to invalidations (call on startup)"""
+        if settings.USER_CACHE_ENABLED and settings.USER_CACHE_LISTEN and self._pg_listener is None:
+            self._pg_listener = asyncio.create_task(self._listen_for_database_changes())
+        if not self.redis_url or self._redis is not None:
+            return
+        self._redis = aioredis.from_url(self.redis_url, decode_responses=True)
+        self._set_if_generation = self._redis.register_script(SET_IF_GENERATION_LUA)
+        self._listener = asyncio.create_task(self._listen_for_invalidations())
+        logger.info("User principal cache: Redis tier enabled")
+
+    async def stop(self):
+        """Stop the invalidation listeners and close Redis (call on shutdown)"""
+        for listener in (self._listener, self._pg_listener):
+            if listener:
+                listener.cancel()
+                try:
+                    await listener
+                except asyncio.CancelledError:
+                    pass
+        self._listener = None
+        self._pg_listener = None
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+            self._set_if_generation = None
+
+    async def _listen_for_invalidations(self):
+        """Drop local entries invalidated by any gateway replica"""
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._invalidate_local(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except RedisError as e:
+                self.redis_errors += 1
+                # Entries published while disconnected may have been missed
+                self._clear_local()
+                logger.warning(f"User cache invalidation listener error, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+    async def _listen_for_database_changes(self):
+        """LISTEN for principals changed in Postgres (see notify_user_principal_invalidate)"""
+        while True:
+            try:
+                conn = await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True)
+                async with conn:
+                    await conn.execute(f"LISTEN {PG_INVALIDATION_CHANNEL}")
+                    async for notify in conn.notifies():
+                        # No publish: every worker gets the NOTIFY itself
+                        self._invalidate_local(notify.payload)
+                        await self._invalidate_redis(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except psycopg.Error as e:
+                self._clear_local()
+                logger.warning(f"User cache database listener error, reconnecting: {e}")
+                await asyncio.sleep(5)
+
+    def _invalidate_local(self, sub: str):
+        if len(self._versions) >= self.local.max_size:
+            # Bounded: restarting the epoch outdates every in-flight load at once
+            self._versions.clear()
+            self._epoch += 1
+        self._versions[sub] = self._versions.get(sub, 0) + 1
+        self.local.invalidate(sub)
+
+    def _clear_local(self):
+        self._versions.clear()
+        self._epoch += 1
+        self.local.clear()
+
+    def _local_version(self, sub: str) -> Tuple[int, int]:
+        return self._epoch, self._versions.get(sub, 0)
+
+    async def version(self, sub: str) -> Tuple[int, int, Optional[str]]:
+        """Take before loading a principal; pass to set() so a load overtaken by an invalidation isn't cached
+
+        Holds this worker's version and, with the Redis tier, the shared
+        generation counter (None if it couldn't be read: the load is then
+        cached locally only).
+        """
+        generation = None
+        if self._redis is not None:
+            try:
+                generation = await self._redis.get(GENERATION_KEY_PREFIX + sub) or "0"
+            except RedisError as e:
+                self.redis_errors += 1
+                logger.warning(f"User cache Redis generation read failed: {e}")
+        return (*self._local_version(sub), generation)
+
+    async def get(self, sub: str) -> Optional[dict]:
+        """Look up a principal in the local tier, then Redis"""
+        user = self.local.get(sub)
+        if user is not None:
+            return dict(user)
+        if self._redis is None:
+            return None
+        version = self._local_version(sub)
+        try:
+            raw = await self._redis.get(REDIS_KEY_PREFIX + sub)
+        except RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"User cache Redis read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        user = json.loads(raw)
+        self.redis_hits += 1
+        # An invalidation may have arrived over pub/sub while the read was in flight
+        if version == self._local_version(sub):
+            self.local.set(sub, user)
+        return dict(user)
+
+    async def set(self, sub: str, user: dict, version: Optional[Tuple[int, int, Optional[str]]] = None):
+        """Store a freshly loaded principal in both tiers, unless it was invalidated since `version`"""
+        if version is not None and version[:2] != self._local_version(sub):
+            return
+        self.local.set(sub, dict(user))
+        if self._redis is None:
+            return
+        payload = json.dumps(user, default=str)
+        try:
+            if version is None:
+                await self._redis.set(REDIS_KEY_PREFIX + sub, payload, ex=int(self.ttl_seconds))
+            elif version[2] is not None:
+                # Another replica may have invalidated it since: compare and set in one step
+                await self._set_if_generation(
+                    keys=[GENERATION_KEY_PREFIX + sub, REDIS_KEY_PREFIX + sub],
+                    args=[version[2], payload, int(self.ttl_seconds)]
+                )
+        except RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"User cache Redis write failed: {e}")
+
+    async def invalidate(self, sub: str):
+        """Drop a principal everywhere (tier changed, user deactivated)"""
+        self._invalidate_local(sub)
+        if await self._invalidate_redis(sub):
+            try:
+                await self._redis.publish(INVALIDATION_CHANNEL, sub)
+            except RedisError as e:
+                self.redis_errors += 1
+                logger.warning(f"User cache Redis invalidation failed: {e}")
+
+    async def _invalidate_redis(self, sub: str) -> bool:
+        """Bump the shared generation (failing in-flight writes) and delete the entry"""
+        if self._redis is None:
+            return False
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.incr(GENERATION_KEY_PREFIX + sub)
+                pipe.expire(GENERATION_KEY_PREFIX + sub, GENERATION_TTL_SECONDS)
+                pipe.delete(REDIS_KEY_PREFIX + sub)
+                await pipe.execute()
+            return True
+        except RedisError as e:
+            self.redis_errors += 1
+            logger.warning(f"User cache Redis invalidation failed: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        """Cache statistics for monitoring"""
+        return {
+            **self.local.get_stats(),
+            "redis_enabled": self._redis is not None,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+        }
+
+user_cache = UserPrincipalCache(
+    max_size=settings.USER_CACHE_MAX_SIZE,
+    ttl_seconds=settings.USER_CACHE_TTL_SECONDS,
+    redis_url=settings.REDIS_URL if settings.USER_CACHE_REDIS_ENABLED else None,
+)